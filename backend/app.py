@@ -1,4 +1,3 @@
-import gradio as gr
 import os
 import tempfile
 from fastapi import FastAPI, File, UploadFile
@@ -62,6 +61,7 @@ def analyze_video(video_file):
 
 # Create Gradio interface
 def create_gradio_app():
+    import gradio as gr
     with gr.Blocks(title="🔍 Deepfake Detector", theme=gr.themes.Soft()) as app:
         gr.Markdown("""
         # 🔍 Deepfake Detector
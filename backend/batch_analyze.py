@@ -0,0 +1,189 @@
+"""Offline batch analysis of many videos with a process pool.
+
+Usage:
+    python batch_analyze.py VIDEOS... [--out results.jsonl] [--workers 2] [--threads 2]
+                            [--checkpoint weights.pth] [--backend eager] [--scan-mode full]
+                            [--save-embeddings STORE]
+
+VIDEOS are directories (searched recursively), glob patterns, or manifest
+files (.txt/.lst) listing one path per line. Each worker process loads the
+model once, with memory-mapped weights so workers share the pages, and
+analyzes videos with sliding_window_inference. One JSONL record is appended
+per video as it finishes; rerunning with the same --out skips videos that
+already completed, so an interrupted sweep resumes where it stopped. With
+--save-embeddings, every frame's backbone embedding is kept in an
+embedding_store.EmbeddingStore for later re-scoring.
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import torch
+
+from embedding_store import EmbeddingStore, backbone_fingerprint
+from engine import ENGINE_BACKENDS, build_engine
+from model import CONFIG, RESULT_FORMATS, SCAN_MODES, get_model, resolve_windows_per_batch, sliding_window_inference
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v", ".mpg", ".mpeg", ".wmv", ".flv")
+MANIFEST_EXTENSIONS = (".txt", ".lst")
+
+def find_videos(inputs):
+    """Absolute video paths from directories, globs and manifests, in order and without duplicates."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, names in os.walk(item):
+                paths.extend(os.path.join(root, n) for n in sorted(names) if n.lower().endswith(VIDEO_EXTENSIONS))
+        elif item.lower().endswith(MANIFEST_EXTENSIONS) and os.path.isfile(item):
+            base = os.path.dirname(item)
+            with open(item) as f:
+                lines = [line.strip() for line in f]
+            paths.extend(os.path.join(base, line) for line in lines if line and not line.startswith("#"))
+        elif os.path.isfile(item):
+            paths.append(item)
+        else:
+            paths.extend(sorted(glob.glob(item, recursive=True)))
+    seen, videos = set(), []
+    for path in map(os.path.abspath, paths):
+        if path not in seen:
+            seen.add(path)
+            videos.append(path)
+    return videos
+
+def completed_paths(out):
+    """Paths with a completed record in `out`; failed videos are retried."""
+    done = set()
+    if not os.path.exists(out):
+        return done
+    with open(out) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted run
+            if record.get("status") == "completed":
+                done.add(record["path"])
+    return done
+
+_runner = None
+_cfg = None
+_store = None
+
+def _init_worker(checkpoint, backend, threads, cfg, embeddings_dir=None, reference_clip=None):
+    """Loads the model once per worker process."""
+    global _runner, _cfg, _store
+    torch.set_num_threads(threads)
+    model = get_model(checkpoint)
+    _runner = build_engine(model, backend, cfg, reference_clip=reference_clip)
+    _cfg = cfg
+    if embeddings_dir:
+        _store = EmbeddingStore(embeddings_dir, backbone_fingerprint(model, cfg, backend))
+
+def analyze_video(path):
+    """One JSONL record: the analysis result plus path and status, or the error."""
+    started = time.perf_counter()
+    record = {"path": path, "status": "failed"}
+    try:
+        errors = []
+        for message in sliding_window_inference(_runner, path, _cfg, embedding_store=_store):
+            if message.startswith("LOG:Error"):
+                errors.append(message[len("LOG:"):])
+            elif message.startswith("RESULT:"):
+                record.update(json.loads(message[len("RESULT:"):]), status="completed")
+        if errors:
+            record["errors"] = errors
+    except Exception as e:
+        record["error"] = str(e)
+    record["elapsed_s"] = round(time.perf_counter() - started, 3)
+    return record
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="+", help="directories, glob patterns or manifest files")
+    parser.add_argument("--out", default="results.jsonl")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument("--threads", type=int, default=None, help="torch threads per worker (default: CPUs / workers)")
+    parser.add_argument("--checkpoint", default=os.environ.get("MODEL_PATH", "visual_only_best_model.pth"))
+    parser.add_argument("--backend", default="eager", choices=ENGINE_BACKENDS)
+    parser.add_argument("--reference-clip", default=os.environ.get("ENGINE_REFERENCE_CLIP") or None,
+                        help="short video with a face to check --backend against eager on")
+    parser.add_argument("--scan-mode", default="full", choices=SCAN_MODES)
+    parser.add_argument("--result-format", default="compact", choices=RESULT_FORMATS,
+                        help="compact keeps face thumbnails small and inline")
+    parser.add_argument("--face-detect-workers", type=int, default=0,
+                        help="detection processes per worker; videos already run in parallel")
+    parser.add_argument("--dedup-threshold", type=float, default=CONFIG['dedup_threshold'],
+                        help="reuse embeddings of near-duplicate frames (0 disables; try 0.01)")
+    parser.add_argument("--save-embeddings", metavar="STORE",
+                        help="keep per-frame embeddings here for embedding_store.py re-scoring (needs --scan-mode full)")
+    args = parser.parse_args(argv)
+    if args.save_embeddings and args.scan_mode != "full":
+        parser.error("--save-embeddings needs --scan-mode full, so every frame is encoded")
+
+    videos = find_videos(args.inputs)
+    done = completed_paths(args.out)
+    todo = [path for path in videos if path not in done]
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    print(f"{len(videos)} videos, {len(videos) - len(todo)} already in {args.out}, {len(todo)} to analyze "
+          f"with {args.workers} worker(s) x {threads} thread(s)")
+    if not todo:
+        return 0
+
+    cfg = {**CONFIG, "scan_mode": args.scan_mode, "result_format": args.result_format,
+           "face_detect_workers": args.face_detect_workers, "timing_events": False,
+           "dedup_threshold": args.dedup_threshold,
+           # Sized here, once, so the workers split the free memory instead of each claiming it
+           "windows_per_batch": resolve_windows_per_batch(CONFIG, args.workers)}
+    if os.path.exists(args.out) and os.path.getsize(args.out):
+        with open(args.out, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    else:
+        needs_newline = False
+
+    started = time.perf_counter()
+    completed = failed = frames = 0
+    video_s = 0.0
+    # Spawned workers do not inherit the parent's threads or torch state
+    with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker,
+                             initargs=(args.checkpoint, args.backend, threads, cfg, args.save_embeddings,
+                                       args.reference_clip)) as pool, \
+            open(args.out, "a") as out:
+        if needs_newline:
+            out.write("\n")
+        futures = [pool.submit(analyze_video, path) for path in todo]
+        try:
+            for n, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                if record["status"] == "completed":
+                    completed += 1
+                    frames += record["sampling"]["frames_analyzed"]
+                    video_s += record.get("video_duration_seconds") or 0
+                    verdict = "deepfake" if record["is_deepfake"] else "authentic"
+                    print(f"[{n}/{len(todo)}] {record['path']}: {verdict} ({record['confidence']:.3f}) "
+                          f"in {record['elapsed_s']:.1f}s")
+                else:
+                    failed += 1
+                    print(f"[{n}/{len(todo)}] {record['path']}: failed: {record.get('error')}")
+        except KeyboardInterrupt:
+            print("Interrupted; rerun the same command to resume")
+            for future in futures:
+                future.cancel()
+            raise
+
+    elapsed = time.perf_counter() - started
+    print(f"Analyzed {completed} videos ({failed} failed) in {elapsed:.1f}s: "
+          f"{completed / elapsed:.2f} videos/s, {frames / elapsed:.1f} frames/s, "
+          f"{video_s / elapsed:.2f}x real time")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
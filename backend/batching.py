@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+class MicroBatcher:
+    """Merges tensors submitted from many threads into one batched call.
+
+    A single worker thread takes the first waiting request, then keeps
+    collecting more until their rows reach `max_batch` or `max_wait_ms` has
+    passed, concatenates them along dim 0, runs `fn` once and hands each
+    caller back its own slice. `submit` blocks once `max_queue` requests are
+    waiting, which pushes back on the analyses feeding it.
+    """
+    def __init__(self, fn, max_batch, max_wait_ms=10, max_queue=64, name="batcher"):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._carry = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+        self.requests = 0
+        self.max_rows = 0
+        self.queue_wait_s = 0.0
+        self.busy_s = 0.0
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, x):
+        future = Future()
+        self._queue.put((x, future, time.perf_counter()))
+        return future
+
+    def __call__(self, x):
+        return self.submit(x).result()
+
+    def _next(self, timeout=None):
+        if self._carry is not None:
+            item, self._carry = self._carry, None
+            return item
+        return self._queue.get(timeout=timeout) if timeout is not None else self._queue.get()
+
+    def _collect(self):
+        batch = [self._next()]
+        rows = batch[0][0].shape[0]
+        deadline = time.perf_counter() + self.max_wait
+        while rows < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._next(remaining)
+            except queue.Empty:
+                break
+            if rows + item[0].shape[0] > self.max_batch:
+                self._carry = item
+                break
+            batch.append(item)
+            rows += item[0].shape[0]
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            start = time.perf_counter()
+            try:
+                with torch.no_grad():
+                    out = self.fn(torch.cat([x for x, _, _ in batch]))
+                parts = out.split([x.shape[0] for x, _, _ in batch])
+                for (_, future, _), part in zip(batch, parts):
+                    future.set_result(part)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            with self._lock:
+                self.batches += 1
+                self.requests += len(batch)
+                rows = sum(x.shape[0] for x, _, _ in batch)
+                self.rows += rows
+                self.max_rows = max(self.max_rows, rows)
+                self.queue_wait_s += sum(start - t for _, _, t in batch)
+                self.busy_s += time.perf_counter() - start
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+                "queue_depth": self._queue.qsize(),
+                "batches": self.batches,
+                "requests": self.requests,
+                "rows": self.rows,
+                "mean_rows_per_batch": round(self.rows / self.batches, 2) if self.batches else 0.0,
+                "max_rows_per_batch": self.max_rows,
+                "mean_queue_wait_ms": round(1000 * self.queue_wait_s / self.requests, 2) if self.requests else 0.0,
+                "busy_s": round(self.busy_s, 3),
+            }
+
+class BatchedModel:
+    """Stand-in for VisualOnlyM3TNet that shares forward passes across analyses.
+
+    Exposes the same `encode`/`score` interface sliding_window_inference
+    uses, routing frames from every in-flight analysis through one backbone
+    batcher and windows through one temporal/head batcher.
+    """
+    def __init__(self, model, max_frames=128, max_windows=32, max_wait_ms=10, max_queue=64):
+        self.model = model
+        self.encoder = MicroBatcher(model.encode, max_frames, max_wait_ms, max_queue, "batch-encode")
+        self.scorer = MicroBatcher(model.score, max_windows, max_wait_ms, max_queue, "batch-score")
+
+    def encode(self, x):
+        return self.encoder(x)
+
+    def score(self, emb):
+        return self.scorer(emb)
+
+    def stats(self):
+        return {"encode": self.encoder.stats(), "score": self.scorer.stats()}
@@ -0,0 +1,288 @@
+"""Per-stage benchmark of the analysis pipeline on synthetic videos.
+
+Usage:
+    python benchmark.py [--out bench.json] [--baseline baseline.json] [--width 1280 --height 720]
+                        [--fps 30] [--seconds 4] [--runs 3] [--checkpoint weights.pth] [--backend eager]
+
+Videos with and without a face are generated locally and analyzed by a
+randomly initialized VisualOnlyM3TNet unless --checkpoint is given, so no
+network access is needed. Stages run serially (pass --pipeline for the
+threaded production settings) so their times add up to the wall time.
+Each scenario runs in its own process, so its peak RSS covers only the
+model and that scenario. Exits with status 1 when a metric regresses past
+--threshold against the baseline.
+"""
+import argparse
+import base64
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import av
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from engine import ENGINE_BACKENDS, build_engine
+from model import CONFIG, VisualOnlyM3TNet, encode_face_images, get_model, sliding_window_inference
+from report_generator import generate_report
+
+# Relative change that counts as a regression, and times too small to judge
+REGRESSION_THRESHOLD = 0.15
+NOISE_FLOOR_S = 0.005
+
+# Metrics where a larger value is better; every other metric should shrink
+HIGHER_IS_BETTER = ("frames_per_s", "windows_per_s")
+
+def draw_face(size):
+    """A cartoon face (RGB) that the HOG face detector picks up."""
+    img = np.full((size, size, 3), 90, np.uint8)
+    c, s = size // 2, size / 256
+    def p(x, y): return (int(c + x*s), int(c + y*s))
+    cv2.ellipse(img, p(0, 0), (int(80*s), int(105*s)), 0, 0, 360, (180, 140, 120), -1)
+    cv2.ellipse(img, p(0, -95), (int(85*s), int(45*s)), 0, 180, 360, (40, 30, 25), -1)
+    for x in (-32, 32):
+        cv2.ellipse(img, p(x, -30), (int(18*s), int(6*s)), 0, 180, 360, (60, 40, 30), max(1, int(4*s)))
+        cv2.ellipse(img, p(x, -12), (int(16*s), int(8*s)), 0, 0, 360, (240, 240, 240), -1)
+        cv2.circle(img, p(x, -12), int(6*s), (40, 30, 20), -1)
+    cv2.polylines(img, [np.array([p(0, -10), p(-10, 30), p(10, 30)])], False, (120, 80, 70), max(1, int(3*s)))
+    cv2.ellipse(img, p(0, 55), (int(28*s), int(10*s)), 0, 0, 180, (150, 60, 60), max(1, int(5*s)))
+    return cv2.GaussianBlur(img, (5, 5), 0)
+
+def synthetic_video(path, width=1280, height=720, fps=30, seconds=4, face=True, seed=0):
+    """Write an H.264 clip of a drifting textured background, optionally with a moving face."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    texture = rng.integers(0, 40, size=(height, width, 3), dtype=np.uint8)
+    sprite = draw_face(min(width, height) // 3) if face else None
+    codec = "libx264" if "libx264" in av.codecs_available else "mpeg4"
+    with av.open(path, "w") as out:
+        stream = out.add_stream(codec, rate=fps)
+        stream.width, stream.height, stream.pix_fmt = width, height, "yuv420p"
+        for i in range(int(fps * seconds)):
+            frame = np.stack([(xx + 4*i) % 200, (yy + 2*i) % 200, (xx + yy + 3*i) % 200], axis=-1).astype(np.uint8)
+            frame += texture
+            if sprite is not None:
+                fs = sprite.shape[0]
+                x = int((width - fs) * (0.5 + 0.3 * np.sin(i / fps)))
+                y = int((height - fs) * (0.5 + 0.2 * np.cos(i / fps)))
+                frame[y:y+fs, x:x+fs] = sprite
+            for packet in stream.encode(av.VideoFrame.from_ndarray(frame, format="rgb24")):
+                out.mux(packet)
+        for packet in stream.encode():
+            out.mux(packet)
+    return path
+
+class TimedModel:
+    """Records the duration of every encode (backbone) and score (temporal + head) call."""
+    def __init__(self, model):
+        self.model = model
+        self.calls = {"backbone": [], "temporal": []}
+
+    def _timed(self, stage, fn, x):
+        t0 = time.perf_counter()
+        out = fn(x)
+        self.calls[stage].append(time.perf_counter() - t0)
+        return out
+
+    def encode(self, x):
+        return self._timed("backbone", self.model.encode, x)
+
+    def score(self, emb):
+        return self._timed("temporal", self.model.score, emb)
+
+def percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p90": 0.0, "p99": 0.0, "mean": 0.0}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"p50": float(p50), "p90": float(p90), "p99": float(p99), "mean": float(np.mean(values))}
+
+def peak_rss_mb():
+    """Peak RSS of this process; run_scenarios gives each scenario a fresh one."""
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (2**20 if sys.platform == "darwin" else 2**10)
+
+def analyze_once(model, video, cfg):
+    """One analysis with per-stage seconds, per-call latencies and the result."""
+    timed = TimedModel(model)
+    result = None
+    t0 = time.perf_counter()
+    for message in sliding_window_inference(timed, video, cfg):
+        if message.startswith("RESULT:"):
+            result = json.loads(message[len("RESULT:"):])
+    wall = time.perf_counter() - t0
+
+    # Result encoding is redone on the reported crops: PNG + base64 + JSON
+    crops = [np.array(Image.open(io.BytesIO(base64.b64decode(b)))) for b in result["face_images_b64"]]
+    t1 = time.perf_counter()
+    json.dumps({**result, "face_images_b64": encode_face_images(crops)})
+    result_encoding = time.perf_counter() - t1
+
+    t2 = time.perf_counter()
+    generate_report(result)
+    pdf = time.perf_counter() - t2
+
+    stages = {name: s["busy_s"] for name, s in result["pipeline"]["stages"].items()}
+    stages_s = {
+        "decode": stages.get("decode", 0.0),
+        "face_detection": stages.get("face_detection", 0.0),
+        "preprocess": stages.get("preprocess", 0.0),
+        "backbone": sum(timed.calls["backbone"]),
+        "temporal": sum(timed.calls["temporal"]),
+        "result_encoding": result_encoding,
+        "pdf": pdf,
+    }
+    return wall, stages_s, timed.calls, result
+
+def run_scenario(model, video, cfg, runs, warmup):
+    for _ in range(warmup):
+        analyze_once(model, video, cfg)
+    walls, stage_runs, pdf_calls = [], [], []
+    calls = {"backbone": [], "temporal": []}
+    for _ in range(runs):
+        wall, stages_s, run_calls, result = analyze_once(model, video, cfg)
+        walls.append(wall)
+        stage_runs.append(stages_s)
+        pdf_calls.append(stages_s["pdf"])
+        for stage in calls:
+            calls[stage].extend(run_calls[stage])
+    median_wall = float(np.median(walls))
+    frames = result["sampling"]["frames_analyzed"]
+    windows = result["windows_analyzed"]
+    return {
+        "runs": runs,
+        "frames": frames,
+        "windows": windows,
+        "faces_found": len(result["face_images_b64"]),
+        "wall_s": percentiles(walls),
+        "frames_per_s": frames / median_wall if median_wall else 0.0,
+        "windows_per_s": windows / median_wall if median_wall else 0.0,
+        "stages_s": {stage: float(np.median([r[stage] for r in stage_runs])) for stage in stage_runs[0]},
+        "latency_ms": {
+            "backbone_call": {k: v * 1000 for k, v in percentiles(calls["backbone"]).items()},
+            "temporal_call": {k: v * 1000 for k, v in percentiles(calls["temporal"]).items()},
+            "pdf": {k: v * 1000 for k, v in percentiles(pdf_calls).items()},
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def load_runner(checkpoint, backend):
+    if checkpoint:
+        model = get_model(checkpoint)
+    else:
+        torch.manual_seed(0)
+        model = VisualOnlyM3TNet(CONFIG, pretrained=False).eval()
+    return build_engine(model, backend, CONFIG, check=False)
+
+def _scenario_process(checkpoint, backend, threads, video, cfg, runs, warmup):
+    torch.set_num_threads(threads)
+    return run_scenario(load_runner(checkpoint, backend), video, cfg, runs, warmup)
+
+def run_scenario_process(checkpoint, backend, video, cfg, runs, warmup):
+    """run_scenario in a fresh spawned process, so ru_maxrss is not shared with earlier scenarios."""
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(_scenario_process, checkpoint, backend, torch.get_num_threads(),
+                           video, cfg, runs, warmup).result()
+
+def comparable_metrics(scenario):
+    """Flat {metric: value} of the numbers worth tracking between runs."""
+    out = {"wall_s.p50": scenario["wall_s"]["p50"], "frames_per_s": scenario["frames_per_s"],
+           "windows_per_s": scenario["windows_per_s"], "peak_rss_mb": scenario["peak_rss_mb"]}
+    for stage, seconds in scenario["stages_s"].items():
+        out[f"stages_s.{stage}"] = seconds
+    for name, stats in scenario["latency_ms"].items():
+        out[f"latency_ms.{name}.p90"] = stats["p90"]
+    return out
+
+def compare(current, baseline, threshold=REGRESSION_THRESHOLD):
+    """Regressions of `current` against `baseline`: [(scenario, metric, baseline, current, change)]."""
+    regressions = []
+    for name, scenario in current["scenarios"].items():
+        if name not in baseline.get("scenarios", {}):
+            continue
+        before = comparable_metrics(baseline["scenarios"][name])
+        for metric, value in comparable_metrics(scenario).items():
+            ref = before.get(metric)
+            if not ref:
+                continue
+            if metric.startswith("stages_s.") and max(ref, value) < NOISE_FLOOR_S:
+                continue
+            change = (value - ref) / ref
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if worse > threshold:
+                regressions.append((name, metric, ref, value, change))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", default="benchmark.json")
+    parser.add_argument("--baseline", help="earlier --out file to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--seconds", type=float, default=4)
+    parser.add_argument("--scenarios", nargs="+", default=["face", "no_face"], choices=["face", "no_face"])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--video-dir", default=os.path.join(tempfile.gettempdir(), "m3tnet-bench"))
+    parser.add_argument("--checkpoint", help="real weights instead of a random model")
+    parser.add_argument("--backend", default="eager", choices=ENGINE_BACKENDS)
+    parser.add_argument("--pipeline", action="store_true", help="threaded stages and detection pool as in CONFIG")
+    args = parser.parse_args(argv)
+
+    cfg = {**CONFIG, "scan_mode": "full"}
+    if not args.pipeline:
+        cfg.update(pipeline=False, face_detect_workers=0)
+
+    os.makedirs(args.video_dir, exist_ok=True)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "threads": torch.get_num_threads(),
+            "cpu_count": os.cpu_count(),
+            "backend": args.backend,
+            "random_weights": not args.checkpoint,
+            "pipeline": args.pipeline,
+            "video": {"width": args.width, "height": args.height, "fps": args.fps, "seconds": args.seconds},
+        },
+        "scenarios": {},
+    }
+    for name in args.scenarios:
+        path = os.path.join(args.video_dir, f"{name}-{args.width}x{args.height}-{args.fps}fps-{args.seconds}s.mp4")
+        if not os.path.exists(path):
+            synthetic_video(path, args.width, args.height, args.fps, args.seconds, face=name == "face")
+        scenario = run_scenario_process(args.checkpoint, args.backend, path, cfg, args.runs, args.warmup)
+        report["scenarios"][name] = scenario
+        stages = ", ".join(f"{stage} {s:.2f}s" for stage, s in scenario["stages_s"].items())
+        print(f"{name}: {scenario['frames_per_s']:.1f} frames/s, {scenario['windows_per_s']:.2f} windows/s, "
+              f"p50 {scenario['wall_s']['p50']:.2f}s, peak RSS {scenario['peak_rss_mb']:.0f} MB")
+        print(f"  {stages}")
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}")
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(report, baseline, args.threshold)
+    for name, metric, ref, value, change in regressions:
+        print(f"REGRESSION {name} {metric}: {ref:.4g} -> {value:.4g} ({change:+.0%})")
+    if not regressions:
+        print(f"No regressions against {args.baseline} (threshold {args.threshold:.0%})")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
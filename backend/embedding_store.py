@@ -0,0 +1,239 @@
+"""Per-frame backbone embeddings on disk, for re-scoring without the backbone.
+
+Usage:
+    python embedding_store.py STORE [--checkpoint weights.pth] [--fingerprint FP]
+                              [--window-size 16] [--window-stride 8] [--threshold 0.5]
+                              [--suspect-band 0.025 0.03] [--out rescored.jsonl]
+
+Layout: STORE/<fingerprint>/<content sha256>.emb.npy (float16, one row per
+analyzed frame), .boxes.npy (int32 top, right, bottom, left; -1 without a
+face) and .json metadata, written last so its presence marks a complete
+entry; the metadata files are the index. The fingerprint covers the
+backbone weights and the settings that change what the backbone sees, so
+retrained temporal/head weights, other window configs and other
+thresholds all reuse the same entries.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from model import CONFIG, DEEPFAKE_THRESHOLD, SUSPECT_BAND, deepfake_verdict, device, get_scorer
+from result_cache import file_sha256
+
+# Settings that change a frame's embedding: sampling, resolution, face localization, dedup
+EMBEDDING_KEYS = ("vision_model_name", "frame_size", "decode_max_side", "sample_every_n", "target_fps",
+                  "face_detect_max_side", "face_redetect_every", "face_track_min_confidence", "dedup_threshold")
+
+def backbone_fingerprint(model, cfg=CONFIG, backend="eager"):
+    """Identifies the backbone weights, inference backend and frame settings embeddings came from."""
+    h = hashlib.sha256()
+    for name, tensor in model.visual.state_dict().items():
+        h.update(name.encode())
+        h.update(tensor.detach().cpu().contiguous().numpy())
+    h.update(json.dumps({"backend": backend, **{k: cfg[k] for k in EMBEDDING_KEYS}}, sort_keys=True).encode())
+    return h.hexdigest()[:16]
+
+def _save_array(path, array):
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+class EmbeddingWriter:
+    """Streams one video's frame embeddings to disk as sliding_window_inference computes them.
+
+    Rows are written straight into a float16 .npy file in the store
+    directory at their frame index, so only the set of written indices is
+    kept in memory. save() rewrites the header with the final frame count
+    (numpy pads .npy headers so the row count can grow in place) and hands
+    the file to the store; discard() drops an unsaved one.
+    """
+    def __init__(self, store, video_path):
+        self.store = store
+        self.video_path = video_path
+        self.written = set()
+        self.boxes = {}
+        self.dim = None
+        self._path = None
+        self._file = None
+        self._data_offset = 0
+
+    def __len__(self):
+        return len(self.written)
+
+    def _write_header(self, frames):
+        self._file.seek(0)
+        np.lib.format.write_array_header_1_0(self._file, {"descr": "<f2", "fortran_order": False,
+                                                          "shape": (frames, self.dim)})
+        return self._file.tell()
+
+    def add(self, idx, emb):
+        row = emb.detach().to('cpu', torch.float16).numpy().astype("<f2", copy=False)
+        if self._file is None:
+            self.dim = row.shape[-1]
+            fd, self._path = tempfile.mkstemp(suffix=".emb.part", dir=self.store.path)
+            self._file = os.fdopen(fd, "w+b")
+            self._data_offset = self._write_header(0)
+        self._file.seek(self._data_offset + idx * self.dim * 2)  # float16 rows
+        self._file.write(row.tobytes())
+        self.written.add(idx)
+
+    def box(self, idx, box):
+        self.boxes[idx] = box
+
+    def save(self, frames, info):
+        """Store the first `frames` analyzed frames under the video's content hash. Returns the entry key."""
+        if not any(idx < frames for idx in self.written):
+            raise ValueError("no frame embeddings to save")
+        if self._write_header(frames) != self._data_offset:
+            raise RuntimeError("embedding file header changed size")
+        # Frames never encoded read back as zero rows; rows past `frames` are cut off
+        self._file.truncate(self._data_offset + frames * self.dim * 2)
+        self._file.close()
+        self._file = None
+        try:
+            return self.store.put(file_sha256(self.video_path), frames, self._path, self.dim,
+                                  self.written, self.boxes, info)
+        finally:
+            self.discard()
+
+    def discard(self):
+        """Remove the unsaved embedding file, if any."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._path is not None:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+            self._path = None
+
+class EmbeddingStore:
+    """Memory-mapped float16 frame embeddings keyed by video content hash and backbone fingerprint."""
+    def __init__(self, directory, fingerprint):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.path = os.path.join(directory, fingerprint)
+        os.makedirs(self.path, exist_ok=True)
+
+    def writer(self, video_path):
+        return EmbeddingWriter(self, video_path)
+
+    def _file(self, content_hash, suffix):
+        return os.path.join(self.path, content_hash + suffix)
+
+    def put(self, content_hash, frames, embeddings_path, dim, written, boxes, info):
+        """Add one video's entry from a finished (frames, dim) .npy file of embeddings, which is moved into place.
+
+        `written` holds the frame indices that have an embedding and `boxes`
+        maps frame index to face box.
+        """
+        written = {idx for idx in written if idx < frames}
+        if not written:
+            raise ValueError("no frame embeddings to save")
+        box_rows = np.full((frames, 4), -1, np.int32)
+        for idx, box in boxes.items():
+            if box is not None and idx < frames:
+                box_rows[idx] = box
+        os.replace(embeddings_path, self._file(content_hash, ".emb.npy"))
+        _save_array(self._file(content_hash, ".boxes.npy"), box_rows)
+        meta = {**info, "content_hash": content_hash, "fingerprint": self.fingerprint, "frames": frames,
+                "dim": dim, "missing": [idx for idx in range(frames) if idx not in written],
+                "created": time.time()}
+        with open(self._file(content_hash, ".json.tmp"), "w") as f:
+            json.dump(meta, f)
+        os.replace(self._file(content_hash, ".json.tmp"), self._file(content_hash, ".json"))
+        return f"{self.fingerprint}/{content_hash}"
+
+    def get(self, content_hash):
+        """The entry's metadata and memory-mapped (frames, dim) embeddings and (frames, 4) boxes, or None."""
+        try:
+            with open(self._file(content_hash, ".json")) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return {"info": info,
+                "embeddings": np.load(self._file(content_hash, ".emb.npy"), mmap_mode="r"),
+                "boxes": np.load(self._file(content_hash, ".boxes.npy"), mmap_mode="r")}
+
+    def entries(self):
+        """Content hashes of the complete entries."""
+        return sorted(name[:-len(".json")] for name in os.listdir(self.path) if name.endswith(".json"))
+
+    def stats(self):
+        entries = self.entries()
+        size = sum(os.path.getsize(self._file(h, suffix)) for h in entries for suffix in (".emb.npy", ".boxes.npy"))
+        return {"fingerprint": self.fingerprint, "videos": len(entries), "bytes": size}
+
+def rescore(scorer, embeddings, window_size, stride, missing=(), windows_per_batch=32):
+    """(window starts, probabilities) over stored (frames, dim) embeddings; windows with missing frames are skipped."""
+    missing = set(missing)
+    starts = [s for s in range(0, len(embeddings) - window_size + 1, stride)
+              if not missing or missing.isdisjoint(range(s, s + window_size))]
+    probs = []
+    for k in range(0, len(starts), windows_per_batch):
+        batch = np.stack([embeddings[s:s + window_size] for s in starts[k:k + windows_per_batch]])
+        with torch.no_grad():
+            probs += torch.sigmoid(scorer.score(torch.from_numpy(batch).float().to(device))).tolist()
+    return starts, probs
+
+def rescore_store(store, scorer, window_size=CONFIG['window_size'], stride=CONFIG['window_stride'],
+                  threshold=DEEPFAKE_THRESHOLD, suspect_band=SUSPECT_BAND):
+    """One verdict record per stored video, scored by `scorer` with the given window config and thresholds."""
+    for content_hash in store.entries():
+        entry = store.get(content_hash)
+        if entry is None:
+            continue
+        info = entry["info"]
+        starts, probs = rescore(scorer, entry["embeddings"], window_size, stride, info["missing"])
+        max_prob = max(probs) if probs else 0
+        yield {"content_hash": content_hash, "filename": info.get("filename"),
+               "is_deepfake": deepfake_verdict(max_prob, threshold, suspect_band), "confidence": max_prob,
+               "probabilities": probs, "window_starts": starts, "windows_analyzed": len(probs),
+               "window_size": window_size, "window_stride": stride}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-score stored frame embeddings with the temporal encoder and head only.")
+    parser.add_argument("store", help="directory written by batch_analyze.py --save-embeddings")
+    parser.add_argument("--checkpoint", default=os.environ.get("MODEL_PATH", "visual_only_best_model.pth"),
+                        help="temporal encoder and head weights; the backbone is not loaded")
+    parser.add_argument("--fingerprint", help="backbone fingerprint to read (default: the only one in STORE)")
+    parser.add_argument("--window-size", type=int, default=CONFIG['window_size'])
+    parser.add_argument("--window-stride", type=int, default=CONFIG['window_stride'])
+    parser.add_argument("--threshold", type=float, default=DEEPFAKE_THRESHOLD)
+    parser.add_argument("--suspect-band", type=float, nargs=2, default=SUSPECT_BAND)
+    parser.add_argument("--out", default="rescored.jsonl")
+    args = parser.parse_args(argv)
+
+    fingerprint = args.fingerprint
+    if fingerprint is None:
+        found = sorted(name for name in os.listdir(args.store) if os.path.isdir(os.path.join(args.store, name)))
+        if len(found) != 1:
+            parser.error(f"{args.store} holds {len(found)} fingerprints ({', '.join(found)}); pick one with --fingerprint")
+        fingerprint = found[0]
+    store = EmbeddingStore(args.store, fingerprint)
+    scorer = get_scorer(args.checkpoint)
+
+    started = time.perf_counter()
+    videos = windows = deepfakes = 0
+    with open(args.out, "w") as out:
+        for record in rescore_store(store, scorer, args.window_size, args.window_stride,
+                                    args.threshold, tuple(args.suspect_band)):
+            out.write(json.dumps(record) + "\n")
+            videos += 1
+            windows += record["windows_analyzed"]
+            deepfakes += record["is_deepfake"]
+    elapsed = time.perf_counter() - started
+    print(f"Re-scored {videos} videos ({windows} windows, {deepfakes} deepfake) in {elapsed:.1f}s "
+          f"to {args.out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
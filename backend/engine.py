@@ -0,0 +1,248 @@
+import copy
+import json
+import os
+import tempfile
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from model import (CONFIG, DEEPFAKE_THRESHOLD, IMAGENET_MEAN, IMAGENET_STD, SUSPECT_BAND, deepfake_verdict,
+                   sliding_window_inference)
+
+ENGINE_BACKENDS = ("eager", "int8", "bf16", "compile", "torchscript", "onnx")
+
+# Largest difference in window probability from eager a backend may show;
+# well under the 0.005-wide SUSPECT_BAND. Crossing any verdict boundary is
+# refused whatever the difference.
+ENGINE_TOLERANCE = 0.001
+
+class EngineParityError(RuntimeError):
+    """Raised by build_engine when a backend drifts too far from eager."""
+
+class InferenceEngine:
+    """A VisualOnlyM3TNet stand-in running encode/score through one backend.
+
+    Exposes the same `encode`/`score` interface as the model, so it can be
+    passed to sliding_window_inference or wrapped in batching.BatchedModel.
+    Outputs are always float32, whatever precision the backend computes in.
+    """
+    def __init__(self, backend, encode, score):
+        self.backend = backend
+        self.parity = None
+        self._encode = encode
+        self._score = score
+
+    def encode(self, x):
+        with torch.no_grad():
+            return self._encode(x).float()
+
+    def score(self, emb):
+        with torch.no_grad():
+            return self._score(emb).float()
+
+class _Scorer(nn.Module):
+    """Temporal transformer and head as one module, for tracing and export.
+
+    With `fused=False` the encoder layers skip PyTorch's fused inference
+    kernel, which needs float weights. That path calls the layers' private
+    `_sa_block`/`_ff_block`, so callers must be ready for it to fail on
+    another torch version.
+    """
+    def __init__(self, model, fused=True):
+        super().__init__()
+        self.temp, self.head, self.fused = model.temp, model.head, fused
+        # Inference only; exporters restore this mode on the shared submodules
+        self.eval()
+    def forward(self, emb):
+        if self.fused:
+            return self.head(self.temp(emb))
+        x = emb
+        for layer in self.temp.enc.layers:
+            x = layer.norm1(x + layer._sa_block(x, None, None))
+            x = layer.norm2(x + layer._ff_block(x))
+        return self.head(x)
+
+def _eager(model, cfg, workdir):
+    return InferenceEngine("eager", model.encode, model.score)
+
+def _int8(model, cfg, workdir):
+    from torch.ao.quantization import quantize_dynamic
+    q = quantize_dynamic(copy.deepcopy(model), {nn.Linear}, dtype=torch.qint8)
+    scorer = _Scorer(q, fused=False)
+    try:
+        with torch.no_grad():
+            scorer(_example_inputs(model, cfg)[1])
+    except (AttributeError, TypeError):
+        # This torch changed the private layer blocks; score in eager float, the backbone stays int8
+        scorer = model.score
+    return InferenceEngine("int8", q.encode, scorer)
+
+def _bf16_supported():
+    """Whether the CPU computes bf16 natively. Asks a private torch op; a torch without it counts as no."""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+def _bf16(model, cfg, workdir):
+    if not _bf16_supported():
+        raise RuntimeError("this CPU has no bf16 support")
+    def autocast(fn):
+        def run(x):
+            with torch.autocast("cpu", dtype=torch.bfloat16):
+                return fn(x)
+        return run
+    return InferenceEngine("bf16", autocast(model.encode), autocast(model.score))
+
+def _compile(model, cfg, workdir):
+    # Frame and window counts vary per chunk; dynamic shapes avoid a recompile for each
+    return InferenceEngine("compile", torch.compile(model.visual.backbone, dynamic=True),
+                           torch.compile(_Scorer(model), dynamic=True))
+
+def _example_inputs(model, cfg):
+    size = cfg['frame_size']
+    return torch.zeros(2, 3, size, size), torch.zeros(2, cfg['window_size'], model.visual.dim)
+
+def _torchscript(model, cfg, workdir):
+    frames, emb = _example_inputs(model, cfg)
+    with torch.no_grad():
+        backbone = torch.jit.freeze(torch.jit.trace(model.visual.backbone, frames))
+        scorer = torch.jit.freeze(torch.jit.trace(_Scorer(model), emb))
+    return InferenceEngine("torchscript", backbone, scorer)
+
+class _OrtGraph:
+    """Runs one exported ONNX graph, opening its session in the process that calls it.
+
+    ORT sessions are not fork-safe and fix their thread count when created,
+    so a forked inference worker opens its own after setting its threads
+    instead of using the parent's.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._session = None
+        self._pid = None
+
+    def _open(self):
+        import onnxruntime as ort
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = torch.get_num_threads()
+        self._session = ort.InferenceSession(self.path, opts, providers=["CPUExecutionProvider"])
+        self._pid = os.getpid()
+
+    def __call__(self, x):
+        if self._pid != os.getpid():
+            self._open()
+        return torch.from_numpy(self._session.run(None, {"x": x.contiguous().numpy()})[0])
+
+def _onnx(model, cfg, workdir):
+    # Sessions open lazily; import here so a missing onnxruntime refuses the backend at startup
+    import onnxruntime
+    frames, emb = _example_inputs(model, cfg)
+    workdir = workdir or tempfile.mkdtemp(prefix="m3tnet-onnx-")
+    os.makedirs(workdir, exist_ok=True)
+    graphs = []
+    for name, module, example in (("backbone", model.visual.backbone, frames), ("scorer", _Scorer(model), emb)):
+        path = os.path.join(workdir, f"{name}.onnx")
+        if not os.path.exists(path):
+            # Traced with autograd on, so attention takes its exportable unfused path
+            with torch.enable_grad():
+                torch.onnx.export(module, (example,), path + ".tmp", input_names=["x"], output_names=["y"],
+                                  dynamic_axes={"x": {0: "n"}, "y": {0: "n"}}, dynamo=False)
+            os.replace(path + ".tmp", path)
+        graphs.append(_OrtGraph(path))
+    return InferenceEngine("onnx", graphs[0], graphs[1])
+
+BACKENDS = {"eager": _eager, "int8": _int8, "bf16": _bf16, "compile": _compile,
+            "torchscript": _torchscript, "onnx": _onnx}
+
+def reference_windows(cfg=CONFIG, windows=2, seed=0):
+    """Smooth, normalized synthetic frames for a startup parity check: (windows * window_size, C, H, W)."""
+    g = torch.Generator().manual_seed(seed)
+    size = cfg['frame_size']
+    coarse = torch.rand(windows * cfg['window_size'], 3, 8, 8, generator=g)
+    frames = F.interpolate(coarse, size=(size, size), mode='bicubic', align_corners=False).clamp(0, 1)
+    mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+    return (frames - mean) / std
+
+def window_probabilities(runner, frames, window_size):
+    """Window probabilities of consecutive `window_size`-frame groups of `frames`."""
+    with torch.no_grad():
+        emb = runner.encode(frames)
+        return torch.sigmoid(runner.score(emb.view(-1, window_size, emb.shape[-1])))
+
+def _verdict_side(p):
+    """Which side of each deepfake_verdict boundary a window probability falls on."""
+    return (p > SUSPECT_BAND[0], p < SUSPECT_BAND[1], p > DEEPFAKE_THRESHOLD)
+
+def verdict_changes(ref, out):
+    """Whether the video verdict differs between two sets of window probabilities, and how many windows cross a boundary."""
+    ref, out = [float(p) for p in ref], [float(p) for p in out]
+    changed = bool(ref) and bool(out) and deepfake_verdict(max(ref)) != deepfake_verdict(max(out))
+    crossed = sum(_verdict_side(r) != _verdict_side(o) for r, o in zip(ref, out))
+    return {"verdict_changed": changed, "windows_crossing": crossed}
+
+def probability_parity(ref, out):
+    """Max and mean absolute difference between two sets of window probabilities, plus verdict_changes."""
+    diff = (out - ref).abs()
+    return {"max_abs_diff": float(diff.max()), "mean_abs_diff": float(diff.mean()), **verdict_changes(ref, out)}
+
+def parity_failure(parity, tolerance):
+    """Why `parity` (from probability_parity) is not acceptable, or None."""
+    if parity["verdict_changed"]:
+        return "change the verdict"
+    if parity["windows_crossing"]:
+        return f"move {parity['windows_crossing']} window(s) across a verdict boundary"
+    if parity["max_abs_diff"] > tolerance:
+        return f"differ from eager by up to {parity['max_abs_diff']:.4f} (tolerance {tolerance})"
+    return None
+
+def engine_parity(model, engine, frames, window_size):
+    """Max and mean absolute window-probability difference between `engine` and eager `model`."""
+    ref = window_probabilities(model, frames, window_size)
+    out = window_probabilities(engine, frames, window_size)
+    return probability_parity(ref, out)
+
+def clip_probabilities(runner, video_path, cfg=CONFIG):
+    """Window probabilities of a full scan of `video_path`."""
+    result = None
+    for message in sliding_window_inference(runner, video_path, {**cfg, "scan_mode": "full", "face_detect_workers": 0}):
+        if message.startswith("RESULT:"):
+            result = json.loads(message[len("RESULT:"):])
+    if result is None:
+        raise RuntimeError(f"analysis of {video_path} gave no result")
+    return torch.tensor(result["probabilities"])
+
+def clip_parity(model, engine, video_path, cfg=CONFIG):
+    """engine_parity over the windows of a real clip, with its faces localized as in analysis."""
+    ref = clip_probabilities(model, video_path, cfg)
+    out = clip_probabilities(engine, video_path, cfg)
+    if len(ref) == 0 or len(out) != len(ref):
+        raise RuntimeError(f"{video_path} gave {len(ref)} eager and {len(out)} engine windows; "
+                           f"a reference clip needs at least {cfg['window_size']} frames")
+    return {**probability_parity(ref, out), "reference": video_path}
+
+def build_engine(model, backend="eager", cfg=CONFIG, workdir=None, tolerance=ENGINE_TOLERANCE, check=True,
+                 reference_clip=None):
+    """Wrap `model` in the named backend, refusing it if it drifts past `tolerance`
+    or moves any window across a verdict boundary (SUSPECT_BAND, DEEPFAKE_THRESHOLD).
+
+    The check compares window probabilities on `reference_clip`, a short
+    video with a face, when given, and on synthetic frames otherwise. It
+    also serves as warm-up, so compile/trace cost is paid here and not by
+    the first analysis. `workdir` keeps exported ONNX graphs between runs;
+    give each checkpoint its own directory.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {', '.join(ENGINE_BACKENDS)}")
+    engine = BACKENDS[backend](model, cfg, workdir)
+    if check and backend != "eager":
+        if reference_clip:
+            engine.parity = clip_parity(model, engine, reference_clip, cfg)
+        else:
+            engine.parity = engine_parity(model, engine, reference_windows(cfg), cfg['window_size'])
+        failure = parity_failure(engine.parity, tolerance)
+        if failure:
+            raise EngineParityError(f"{backend} window probabilities {failure}")
+    return engine
@@ -0,0 +1,103 @@
+"""Server-sent event streams of a job's progress.
+
+Analyses produce LOG:/STATS:/RESULT: strings. The "legacy" format sends
+them as they are, which is what deepfake-detector.tsx reads. The "json"
+format folds them into typed events:
+
+    {"type": "log", "messages": [...]}
+    {"type": "progress", "stage": ..., "windows": ..., "scored": [{"index", "start", "probability"}], ...}
+    {"type": "error", "detail": ...}
+    {"type": "result", "result": {...}}
+    {"type": "end", "status": "completed" | "failed" | "cancelled", "error": ...}
+
+Every event's SSE id is the number of raw messages it covers, so a client
+that reconnects with Last-Event-ID resumes right after what it has seen.
+"""
+import json
+import time
+
+PROGRESS_FORMATS = ("legacy", "json")
+
+def legacy_sse(messages, first_id=None):
+    """`messages` as SSE `data:` blocks, with ids counting on from `first_id` when given."""
+    if first_id is None:
+        return "".join(f"data: {message}\n\n" for message in messages)
+    return "".join(f"id: {first_id + n}\ndata: {message}\n\n" for n, message in enumerate(messages, 1))
+
+def json_sse(event_id, events):
+    return "".join(f"id: {event_id}\ndata: {json.dumps(event)}\n\n" for event in events)
+
+class EventCoalescer:
+    """Folds raw analysis messages into typed events until `flush`.
+
+    Log lines pile up into one log event and progress updates into one
+    progress event holding the newest counters and every window scored in
+    between. Errors and the result are kept as they come and make the
+    coalescer `urgent`.
+    """
+    def __init__(self):
+        self.logs = []
+        self.progress = None
+        self.urgent = []
+
+    def empty(self):
+        return not self.logs and self.progress is None and not self.urgent
+
+    def add(self, message):
+        kind, _, body = message.partition(":")
+        if kind == "LOG":
+            if body.startswith(("Error", "Analysis failed")):
+                self.urgent.append({"type": "error", "detail": body})
+            else:
+                self.logs.append(body)
+        elif kind == "STATS":
+            stats = json.loads(body)
+            if self.progress is not None:
+                stats["scored"] = self.progress.get("scored", []) + stats.get("scored", [])
+            self.progress = stats
+        elif kind == "RESULT":
+            self.urgent.append({"type": "result", "result": json.loads(body)})
+
+    def flush(self):
+        """The typed events gathered since the last flush."""
+        events = []
+        if self.logs:
+            events.append({"type": "log", "messages": self.logs})
+        if self.progress is not None:
+            events.append({"type": "progress", **self.progress})
+        events.extend(self.urgent)
+        self.logs, self.progress, self.urgent = [], None, []
+        return events
+
+async def json_stream(job, start=0, interval=0.25):
+    """SSE text of `job`'s typed events from raw message `start` on.
+
+    Logs and progress go out at most once per `interval` seconds; errors,
+    the result and the end of the job go out at once.
+    """
+    coalescer = EventCoalescer()
+    pos = start
+    flushed = 0.0
+    job.followers += 1
+    try:
+        while True:
+            timeout = None if coalescer.empty() else max(0.0, flushed + interval - time.monotonic())
+            messages, finished = await job.wait(pos, timeout)
+            for message in messages:
+                coalescer.add(message)
+            pos += len(messages)
+            now = time.monotonic()
+            if not coalescer.empty() and (finished or coalescer.urgent or now - flushed >= interval):
+                yield json_sse(pos, coalescer.flush())
+                flushed = now
+            if finished:
+                yield json_sse(pos, [{"type": "end", "status": job.status, "error": job.error}])
+                return
+    finally:
+        job.followers -= 1
+
+async def legacy_stream(job, start=0, ids=False):
+    """SSE text of `job`'s raw messages from `start` on, one write per wake-up instead of per message."""
+    async for messages in job.follow_batches(start):
+        yield legacy_sse(messages, start if ids else None)
+        start += len(messages)
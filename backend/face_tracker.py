@@ -0,0 +1,157 @@
+import cv2
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+def detect_face(rgb):
+    """First face box in an RGB image, or None.
+
+    Module-level so it can run in a detection worker process. dlib and its
+    models are imported on first use, not when the server starts.
+    """
+    import face_recognition
+    boxes = face_recognition.face_locations(rgb)
+    return tuple(boxes[0]) if boxes else None
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+def detection_pool(workers):
+    """Shared process pool for HOG detection (dlib holds the GIL in places).
+
+    Uses the spawn start method so workers never inherit torch's thread
+    pools or the server's sockets.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+def discard_detection_pool(pool):
+    """Drop a pool that broke (a worker died), so the next detection_pool call builds a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+class FaceTracker:
+    """Per-frame face boxes from downscaled detection plus template tracking.
+
+    HOG detection runs on a copy of the frame scaled down to `detect_max_side`
+    and the box is mapped back to full resolution. Between detections the box
+    is carried forward by normalized cross-correlation of the last face patch
+    against a search region around it. Keyframes (every `redetect_every`-th
+    frame) are always re-detected, and any other frame is re-detected as
+    soon as the match score drops below `min_confidence`. Because keyframes
+    are known in advance, their detections can be computed ahead of time,
+    e.g. in a worker pool, and handed to `locate`. Boxes are memoized by
+    frame index, so overlapping windows never localize the same frame twice.
+
+    Boxes use face_recognition's (top, right, bottom, left) order in
+    full-resolution pixel coordinates; None means no face.
+    """
+    def __init__(self, detect_max_side=640, redetect_every=8, min_confidence=0.6,
+                 cache_frames=256, channel_order='bgr'):
+        self.detect_max_side = detect_max_side
+        self.redetect_every = max(1, redetect_every)
+        self.min_confidence = min_confidence
+        self.cache_frames = cache_frames
+        self.channel_order = channel_order
+        self.boxes = OrderedDict()
+        self.detections = 0
+        self.tracked = 0
+        self._template = None   # grayscale face patch at detection scale
+        self._small_box = None  # (top, right, bottom, left) at detection scale
+
+    def is_keyframe(self, frame_idx):
+        return frame_idx % self.redetect_every == 0
+
+    def downscale(self, frame):
+        """The frame at detection scale, and that scale."""
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.detect_max_side / max(h, w)) if self.detect_max_side else 1.0
+        if scale == 1.0:
+            return frame, scale
+        return cv2.resize(frame, (round(w*scale), round(h*scale)), interpolation=cv2.INTER_AREA), scale
+
+    def detection_input(self, small):
+        """RGB image for `detect_face` from a downscaled frame."""
+        return cv2.cvtColor(small, cv2.COLOR_BGR2RGB) if self.channel_order == 'bgr' else small
+
+    def locate(self, frame_idx, frame, small=None, detection=None):
+        """Face box for `frame_idx`, computing it from `frame` on first request.
+
+        `small` is the frame from `downscale` if already computed, and
+        `detection` a precomputed `detect_face` result for a keyframe; it
+        may be a Future.
+        """
+        if frame_idx in self.boxes:
+            return self.boxes[frame_idx]
+        box = None
+        try:
+            box = self._locate(frame_idx, frame, small, detection)
+        finally:
+            # Remember failures too, so a broken frame is not retried per window
+            self.boxes[frame_idx] = box
+            while len(self.boxes) > self.cache_frames:
+                self.boxes.popitem(last=False)
+        return box
+
+    def _locate(self, frame_idx, frame, small, detection):
+        h, w = frame.shape[:2]
+        if small is None:
+            small, scale = self.downscale(frame)
+        else:
+            scale = small.shape[0] / h
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY if self.channel_order == 'bgr' else cv2.COLOR_RGB2GRAY)
+
+        small_box = None
+        if not self.is_keyframe(frame_idx) and self._template is not None:
+            small_box = self._track(gray)
+            # Lost track: re-detect now rather than waiting for the next keyframe
+            if small_box is None:
+                small_box = self._detect(small)
+        elif self.is_keyframe(frame_idx):
+            if detection is not None:
+                self.detections += 1
+                small_box = detection.result() if hasattr(detection, 'result') else detection
+            else:
+                small_box = self._detect(small)
+
+        self._template = None
+        if small_box is None:
+            return None
+        t,r,b,l = small_box
+        self._template = gray[t:b, l:r].copy()
+        self._small_box = small_box
+        return (min(h, round(t / scale)), min(w, round(r / scale)),
+                min(h, round(b / scale)), min(w, round(l / scale)))
+
+    def _detect(self, small):
+        self.detections += 1
+        return detect_face(self.detection_input(small))
+
+    def _track(self, gray):
+        t,r,b,l = self._small_box
+        th, tw = self._template.shape
+        if th < 8 or tw < 8:
+            return None
+        margin = max(th, tw) // 2
+        H, W = gray.shape
+        y0, x0 = max(0, t - margin), max(0, l - margin)
+        y1, x1 = min(H, b + margin), min(W, r + margin)
+        if y1 - y0 < th or x1 - x0 < tw:
+            return None
+        scores = cv2.matchTemplate(gray[y0:y1, x0:x1], self._template, cv2.TM_CCOEFF_NORMED)
+        _, confidence, _, (dx, dy) = cv2.minMaxLoc(scores)
+        if confidence < self.min_confidence:
+            return None
+        self.tracked += 1
+        return (y0 + dy, x0 + dx + tw, y0 + dy + th, x0 + dx)
@@ -0,0 +1,235 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class QueueFull(Exception):
+    """Raised by JobManager.submit when every worker and queue slot is taken."""
+
+class Job:
+    """One analysis: its progress messages, final result and cancellation flag.
+
+    Messages are appended from a worker thread and followed from the event
+    loop; `follow` wakes subscribers with call_soon_threadsafe instead of
+    polling.
+    """
+    def __init__(self, path, filename, meta=None):
+        self.id = uuid.uuid4().hex
+        self.path = path
+        self.filename = filename
+        self.meta = meta or {}
+        self.status = "queued"
+        self.messages = []
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        self._waiters = []
+        # Streams currently following the job, counted on the event loop
+        self.followers = 0
+
+    @property
+    def done(self):
+        return self.status in ("completed", "failed", "cancelled")
+
+    def append(self, message):
+        with self._lock:
+            self.messages.append(message)
+            self._notify()
+
+    def finish(self, status, error=None):
+        with self._lock:
+            self.status = status
+            self.error = error
+            self.finished = time.time()
+            self._notify()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _notify(self):
+        waiters, self._waiters = self._waiters, []
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    async def wait(self, pos, timeout=None):
+        """Messages from index `pos` on, waiting up to `timeout` seconds for the first.
+
+        Returns (messages, finished); `finished` means no message after
+        these will ever come.
+        """
+        event = asyncio.Event()
+        with self._lock:
+            pending = self.messages[pos:]
+            finished = self.done
+            if pending or finished:
+                return pending, finished
+            self._waiters.append((asyncio.get_running_loop(), event))
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return [], False
+        with self._lock:
+            return self.messages[pos:], self.done
+
+    async def follow_batches(self, start=0):
+        """Yield lists of the messages appended since the last one, from index `start` until the job finishes."""
+        pos = start
+        self.followers += 1
+        try:
+            while True:
+                pending, finished = await self.wait(pos)
+                if pending:
+                    yield pending
+                    pos += len(pending)
+                elif finished:
+                    return
+        finally:
+            self.followers -= 1
+
+    async def follow(self, start=0):
+        """Yield messages from index `start` until the job finishes."""
+        async for batch in self.follow_batches(start):
+            for message in batch:
+                yield message
+
+    def summary(self):
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "messages": len(self.messages),
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+class JobManager:
+    """Runs analyses on a bounded thread pool, off the event loop.
+
+    At most `max_concurrent` jobs run at once and at most `max_queued` more
+    wait for a worker; `submit` raises QueueFull beyond that so the HTTP
+    layer can answer with backpressure. Finished jobs are kept for
+    `retention_seconds` so results can still be fetched, and at most
+    `max_retained` of them: beyond that the least recently fetched go
+    first, since each holds its messages and result. `on_finish(job,
+    status)` runs before the job reads as finished, so whatever it stores
+    (e.g. a cached result) is in place when followers see the end.
+    """
+    def __init__(self, analyze, max_concurrent=2, max_queued=8, retention_seconds=3600, on_finish=None,
+                 max_retained=256):
+        self.analyze = analyze
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.retention_seconds = retention_seconds
+        self.max_retained = max_retained
+        self.on_finish = on_finish
+        # Least recently fetched first
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_concurrent, thread_name_prefix="analysis")
+
+    def active(self):
+        return [job for job in list(self.jobs.values()) if not job.done]
+
+    def counts(self):
+        with self._lock:
+            running = sum(1 for job in self.jobs.values() if job.status == "running")
+            queued = sum(1 for job in self.jobs.values() if job.status == "queued")
+        return {"running": running, "queued": queued,
+                "max_concurrent": self.max_concurrent, "max_queued": self.max_queued}
+
+    def submit(self, path, filename, meta=None):
+        with self._lock:
+            self._prune()
+            if len(self.active()) >= self.max_concurrent + self.max_queued:
+                raise QueueFull()
+            job = Job(path, filename, meta)
+            self.jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def completed(self, filename, messages, result, meta=None):
+        """Register a job whose result is already known, e.g. from a cache."""
+        job = Job(None, filename, meta)
+        job.messages = list(messages)
+        job.result = result
+        job.started = job.created
+        job.finish("completed")
+        with self._lock:
+            self.jobs[job.id] = job
+            self._prune()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                self.jobs.move_to_end(job_id)
+            return job
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [j.id for j in self.jobs.values() if j.done and j.finished < cutoff]:
+            del self.jobs[job_id]
+        finished = [j.id for j in self.jobs.values() if j.done]
+        for job_id in finished[:max(0, len(finished) - self.max_retained)]:
+            del self.jobs[job_id]
+
+    def cancel(self, job):
+        """Stop a job: queued jobs finish immediately, running ones at their next message."""
+        with self._lock:
+            job.cancel()
+            if job.status != "queued":
+                return
+        self._finished(job, "cancelled")
+        job.finish("cancelled")
+
+    def _run(self, job):
+        with self._lock:
+            if job.done or job.cancel_event.is_set():
+                return
+            job.status = "running"
+            job.started = time.time()
+        gen = None
+        try:
+            gen = self.analyze(job)
+            for message in gen:
+                if job.cancel_event.is_set():
+                    break
+                if message.startswith("RESULT:"):
+                    job.result = json.loads(message[len("RESULT:"):])
+                job.append(message)
+            gen.close()
+            status, error = "cancelled" if job.cancel_event.is_set() and job.result is None else "completed", None
+        except Exception as e:
+            if gen is not None:
+                gen.close()
+            job.append(f"LOG:Analysis failed: {str(e)}")
+            status, error = "failed", str(e)
+        self._finished(job, status)
+        job.finish(status, error)
+        with self._lock:
+            self._prune()
+
+    def _finished(self, job, status):
+        if self.on_finish is not None:
+            try:
+                self.on_finish(job, status)
+            except Exception as e:
+                print(f"Job cleanup failed for {job.id}: {e}")
+
+    def shutdown(self):
+        """Cancel every job as `cancel` does, so queued ones finish (and run on_finish) before their futures are dropped."""
+        with self._lock:
+            active = self.active()
+        for job in active:
+            self.cancel(job)
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,26 +1,197 @@
-from fastapi import FastAPI, File, UploadFile
+import time
+BOOT_STARTED = time.perf_counter()  # before the heavy imports, for the cold start report
+
+from fastapi import FastAPI, File, Form, Header, Request, UploadFile, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, Response
-import shutil
+from fastapi.responses import FileResponse, StreamingResponse, Response
+import hashlib
+import io
+import json
+import numpy as np
 import os
 import asyncio
-from contextlib import asynccontextmanager
-from model import get_model, sliding_window_inference
-from report_generator import generate_report
+import tempfile
+import torch
+from contextlib import asynccontextmanager, suppress
+from urllib.parse import urlsplit
+from model import (CONFIG, RESULT_FORMATS, SCAN_MODES, IncrementalAnalyzer, get_model, live_frames,
+                   resolve_windows_per_batch, sliding_window_inference)
+from report_generator import ReportCache
+from jobs import JobManager, QueueFull
+from events import PROGRESS_FORMATS, json_stream, legacy_stream
+from batching import BatchedModel
+from workers import WorkerPool
+from engine import ENGINE_TOLERANCE, build_engine
+from result_cache import ResultCache, ThumbnailStore, checkpoint_sha256, model_fingerprint
+from metrics import REGISTRY
+from PIL import Image
 from pydantic import BaseModel
 from typing import List, Optional
+IMPORTS_DONE = time.perf_counter()
 
-# Load the model on startup
-MODEL_PATH = "visual_only_best_model.pth"
+# Load the model on startup; `python model.py <checkpoint> <out>` prepares a
+# ready-to-run checkpoint that loads faster
+MODEL_PATH = os.environ.get("MODEL_PATH", "visual_only_best_model.pth")
 model = None
 
+# CPU inference backend: eager, int8, bf16, compile, torchscript or onnx. A
+# backend whose window probabilities drift from eager by more than
+# ENGINE_TOLERANCE is refused at startup and eager is used instead. The
+# comparison runs on ENGINE_REFERENCE_CLIP, a short video with a face, when
+# set, and on synthetic frames otherwise.
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "eager")
+ENGINE_TOLERANCE = float(os.environ.get("ENGINE_TOLERANCE", ENGINE_TOLERANCE))
+ENGINE_REFERENCE_CLIP = os.environ.get("ENGINE_REFERENCE_CLIP") or None
+ENGINE_DIR = os.environ.get("ENGINE_DIR", "engines")
+engine = None
+
+# Admission control: analyses running at once, and how many more may wait
+MAX_CONCURRENT_ANALYSES = int(os.environ.get("MAX_CONCURRENT_ANALYSES", 2))
+MAX_QUEUED_ANALYSES = int(os.environ.get("MAX_QUEUED_ANALYSES", 8))
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", 3600))
+JOB_RETENTION_COUNT = int(os.environ.get("JOB_RETENTION_COUNT", 256))
+jobs = None
+
+# Pre-forked inference processes sharing the parent's model weights; 0 runs
+# analyses on threads in this process. Each worker gets WORKER_THREADS torch
+# threads (default: CPUs / workers) and, with WORKER_PIN_CPUS=1, its own CPUs.
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 0))
+WORKER_THREADS = int(os.environ.get("WORKER_THREADS", 0)) or None
+WORKER_PIN_CPUS = os.environ.get("WORKER_PIN_CPUS", "0") == "1"
+worker_pool = None
+
+# Frames this close to the last encoded one reuse its embedding (0 disables);
+# part of CONFIG, so cached results are keyed by it
+CONFIG["dedup_threshold"] = float(os.environ.get("DEDUP_THRESHOLD", CONFIG["dedup_threshold"]))
+
+# Cross-request micro-batching of backbone frames and temporal windows
+MICRO_BATCHING = os.environ.get("MICRO_BATCHING", "1") == "1"
+BATCH_MAX_FRAMES = int(os.environ.get("BATCH_MAX_FRAMES", 128))
+BATCH_MAX_WINDOWS = int(os.environ.get("BATCH_MAX_WINDOWS", 32))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 10))
+BATCH_QUEUE_DEPTH = int(os.environ.get("BATCH_QUEUE_DEPTH", 64))
+batched_model = None
+
+# Content-addressed cache of results for repeat uploads
+UPLOAD_DIR = "uploads"
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "result_cache")
+RESULT_CACHE_MEMORY_ENTRIES = int(os.environ.get("RESULT_CACHE_MEMORY_ENTRIES", 128))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 512 * 2**20))
+RESULT_CACHE_MAX_AGE_SECONDS = int(os.environ.get("RESULT_CACHE_MAX_AGE_SECONDS", 7 * 24 * 3600))
+result_cache = None
+
+# Live analysis over WebSocket: sessions at once, and the sources (path or
+# URL prefixes, comma-separated) clients may ask the server to open
+MAX_LIVE_SESSIONS = int(os.environ.get("MAX_LIVE_SESSIONS", 1))
+LIVE_SOURCES = [prefix for prefix in os.environ.get("LIVE_SOURCES", "").split(",") if prefix]
+live_sessions = 0
+
+# Face thumbnails of compact results, served from /thumbnails/{id}
+THUMBNAIL_DIR = os.environ.get("THUMBNAIL_DIR", "thumbnails")
+THUMBNAIL_MAX_BYTES = int(os.environ.get("THUMBNAIL_MAX_BYTES", 64 * 2**20))
+thumbnail_store = None
+
+# Generated PDF reports, keyed by the result they render
+REPORT_CACHE_MAX_BYTES = int(os.environ.get("REPORT_CACHE_MAX_BYTES", 64 * 2**20))
+report_cache = ReportCache(REPORT_CACHE_MAX_BYTES)
+REPORT_HEADERS = {'Content-Disposition': 'attachment; filename="deepfake_report.pdf"'}
+
+# progress_format=json streams: at most one log/progress event per interval.
+# A json stream that drops before its job ends leaves the job running for
+# RESUME_GRACE_SECONDS, so the client can resume with Last-Event-ID.
+PROGRESS_INTERVAL_MS = float(os.environ.get("PROGRESS_INTERVAL_MS", 250))
+RESUME_GRACE_SECONDS = float(os.environ.get("RESUME_GRACE_SECONDS", 30))
+
+# Prometheus text exposition at /metrics; METRICS=0 turns every update into a no-op
+REGISTRY.enabled = os.environ.get("METRICS", "1") == "1"
+HTTP_SECONDS = REGISTRY.histogram("deepfake_http_request_seconds", "Time to the response headers, per route",
+                                  ["endpoint", "method", "status"])
+STREAM_SECONDS = REGISTRY.histogram("deepfake_stream_seconds", "Lifetime of a progress stream", ["endpoint"])
+STREAMS_OPEN = REGISTRY.gauge("deepfake_streams_open", "Progress streams currently open")
+JOBS_FINISHED = REGISTRY.counter("deepfake_jobs_finished_total", "Analyses finished, by status", ["status"])
+JOB_QUEUE_SECONDS = REGISTRY.histogram("deepfake_job_queue_seconds", "Time an analysis waited for a worker")
+JOB_RUN_SECONDS = REGISTRY.histogram("deepfake_job_run_seconds", "Time an analysis ran, by status", ["status"])
+REGISTRY.gauge("deepfake_jobs", "Analyses by state", ["state"]).set_function(
+    lambda: {(state,): jobs.counts()[state] for state in ("running", "queued")} if jobs is not None else {})
+REGISTRY.gauge("deepfake_batch_queue_depth", "Requests waiting for a shared forward pass", ["part"]).set_function(
+    lambda: {(part,): s["queue_depth"] for part, s in batched_model.stats().items()} if batched_model is not None else {})
+REGISTRY.gauge("deepfake_live_sessions", "Live analysis sessions open").set_function(lambda: live_sessions)
+REGISTRY.counter("deepfake_result_cache_requests_total", "Result cache lookups", ["outcome"]).set_function(
+    lambda: {("hit",): result_cache.hits, ("miss",): result_cache.misses} if result_cache is not None else {})
+
+def finish_job(job, status):
+    """Deletes the job's temporary upload, caches its result and records its timings."""
+    JOBS_FINISHED.inc(status=status)
+    if job.started is not None:
+        JOB_QUEUE_SECONDS.observe(job.started - job.created)
+        JOB_RUN_SECONDS.observe(time.time() - job.started, status=status)
+    if job.path is not None and os.path.exists(job.path):
+        os.remove(job.path)
+    key = job.meta.get("cache_key")
+    if result_cache is not None and key and status == "completed" and job.result is not None:
+        result_cache.put(key, job.result)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Load the ML model
-    global model
+    global model, engine, jobs, batched_model, result_cache, thumbnail_store, worker_pool
+    if INFERENCE_WORKERS:
+        # Workers are forked from this process, which must not start torch's
+        # thread pool first; live sessions here then run single-threaded
+        torch.set_num_threads(1)
+    started = time.perf_counter()
     model = get_model(MODEL_PATH)
+    loaded = time.perf_counter()
+    # Hashed once per checkpoint file, not on every boot; the memo has no
+    # .json suffix, so result cache eviction leaves it alone
+    os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+    checkpoint = checkpoint_sha256(MODEL_PATH, os.path.join(RESULT_CACHE_DIR, "checkpoint-digests"))
+    fingerprint = model_fingerprint(MODEL_PATH, {**CONFIG, "inference_backend": INFERENCE_BACKEND}, checkpoint)
+    try:
+        engine = build_engine(model, INFERENCE_BACKEND, CONFIG, os.path.join(ENGINE_DIR, fingerprint), ENGINE_TOLERANCE,
+                              reference_clip=ENGINE_REFERENCE_CLIP)
+        print(f"Inference backend: {engine.backend}" + (f", parity {engine.parity}" if engine.parity else ""))
+    except Exception as e:
+        print(f"Inference backend {INFERENCE_BACKEND} refused, falling back to eager: {e}")
+        engine = build_engine(model, "eager")
+        fingerprint = model_fingerprint(MODEL_PATH, {**CONFIG, "inference_backend": "eager"}, checkpoint)
+    # "auto" is sized once, for every analysis that may run at the same time
+    CONFIG["windows_per_batch"] = resolve_windows_per_batch(CONFIG, INFERENCE_WORKERS or MAX_CONCURRENT_ANALYSES)
+    if RESULT_CACHE_MAX_BYTES > 0:
+        result_cache = ResultCache(RESULT_CACHE_DIR, fingerprint,
+                                   RESULT_CACHE_MEMORY_ENTRIES, RESULT_CACHE_MAX_BYTES,
+                                   RESULT_CACHE_MAX_AGE_SECONDS)
+    thumbnail_store = ThumbnailStore(THUMBNAIL_DIR, THUMBNAIL_MAX_BYTES, RESULT_CACHE_MAX_AGE_SECONDS)
+    if INFERENCE_WORKERS:
+        # Workers already analyze in parallel, so face detection runs inline in each
+        worker_pool = WorkerPool(engine, INFERENCE_WORKERS, WORKER_THREADS, WORKER_PIN_CPUS, thumbnail_store)
+        analyze = lambda path, cfg, filename: worker_pool.analyze(path, {**cfg, "face_detect_workers": 0}, filename)
+        print(f"Inference workers: {INFERENCE_WORKERS} x {worker_pool.threads} thread(s)"
+              + (", pinned to CPUs" if WORKER_PIN_CPUS else ""))
+    else:
+        if MICRO_BATCHING:
+            batched_model = BatchedModel(engine, BATCH_MAX_FRAMES, BATCH_MAX_WINDOWS,
+                                         BATCH_MAX_WAIT_MS, BATCH_QUEUE_DEPTH)
+        runner = batched_model or engine
+        analyze = lambda path, cfg, filename: sliding_window_inference(runner, path, cfg, filename, thumbnail_store)
+    jobs = JobManager(lambda job: analyze(job.path, {**CONFIG, "scan_mode": job.meta["scan_mode"],
+                                                     "result_format": job.meta["result_format"]}, job.filename),
+                      INFERENCE_WORKERS or MAX_CONCURRENT_ANALYSES, MAX_QUEUED_ANALYSES, JOB_RETENTION_SECONDS,
+                      on_finish=finish_job, max_retained=JOB_RETENTION_COUNT)
+    ready = time.perf_counter()
+    print(f"Cold start: imports {IMPORTS_DONE - BOOT_STARTED:.2f}s, model load {loaded - started:.2f}s, "
+          f"backend and caches {ready - loaded:.2f}s, ready {ready - BOOT_STARTED:.2f}s after boot")
     yield
     # Clean up the model and release the resources
+    jobs.shutdown()
+    jobs = None
+    if worker_pool is not None:
+        worker_pool.shutdown()
+        worker_pool = None
+    batched_model = None
+    result_cache = None
+    thumbnail_store = None
+    engine = None
     model = None
 
 app = FastAPI(lifespan=lifespan)
@@ -32,43 +203,358 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Job-Id"],
 )
 
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # The route template, so job IDs do not each get their own series
+    route = request.scope.get("route")
+    HTTP_SECONDS.observe(time.perf_counter() - started, endpoint=route.path if route else "unmatched",
+                         method=request.method, status=response.status_code)
+    return response
+
+async def timed_stream(endpoint, chunks):
+    """Passes SSE text through, recording how long the stream stays open."""
+    started = time.perf_counter()
+    STREAMS_OPEN.inc()
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        STREAMS_OPEN.dec()
+        STREAM_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+
 @app.get("/")
 def read_root():
     return {"Hello": "World"}
 
-async def run_analysis(file_path: str):
+def cancel_unfollowed(job):
+    if not job.done and not job.followers:
+        jobs.cancel(job)
+
+async def run_analysis(job, progress_format="legacy"):
     """
-    Generator function that runs the analysis and yields SSE-formatted messages.
+    Follows a job's progress and yields SSE-formatted messages.
+    Cancels the job if the client goes away before it finishes; json
+    clients get RESUME_GRACE_SECONDS to reconnect to /jobs/{id}/events.
     """
-    for message in sliding_window_inference(model, file_path):
-        print(message)
-        yield f"data: {message}\n\n"
-        await asyncio.sleep(0.05)  # Small delay to allow messages to be sent
+    if progress_format == "json":
+        stream = json_stream(job, 0, PROGRESS_INTERVAL_MS / 1000)
+    else:
+        stream = legacy_stream(job)
+    chunks = timed_stream("/analyze/", stream)
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        # Close the stream now so it no longer counts as following the job
+        await chunks.aclose()
+        await stream.aclose()
+        if not job.done:
+            if progress_format == "json" and RESUME_GRACE_SECONDS > 0:
+                asyncio.get_running_loop().call_later(RESUME_GRACE_SECONDS, cancel_unfollowed, job)
+            else:
+                jobs.cancel(job)
+
+def save_upload(file: UploadFile):
+    """Streams an upload to a temporary file, hashing it on the way. Returns (path, sha256)."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    suffix = os.path.splitext(file.filename or "")[1]
+    digest = hashlib.sha256()
+    fd, file_path = tempfile.mkstemp(suffix=suffix, dir=UPLOAD_DIR)
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            for chunk in iter(lambda: file.file.read(1 << 20), b""):
+                digest.update(chunk)
+                buffer.write(chunk)
+    except BaseException:
+        os.remove(file_path)
+        raise
+    return file_path, digest.hexdigest()
+
+def submit_upload(file: UploadFile, scan_mode: str = "full", result_format: str = "inline"):
+    """Saves an upload and queues it for analysis, or rejects it when the server is full.
+
+    Uploads whose content was analyzed before with the same model and
+    settings get a job that is already complete with the cached result.
+    """
+    if jobs is None:
+        raise HTTPException(status_code=503, detail="Model is not loaded yet")
+    if scan_mode not in SCAN_MODES:
+        raise HTTPException(status_code=400, detail=f"scan_mode must be one of {', '.join(SCAN_MODES)}")
+    if result_format not in RESULT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"result_format must be one of {', '.join(RESULT_FORMATS)}")
+    filename = os.path.basename(file.filename or "upload")
+    file_path, content_hash = save_upload(file)
+
+    variant = "-".join(v for v, default in ((scan_mode, "full"), (result_format, "inline")) if v != default)
+    key = result_cache.key(content_hash, variant) if result_cache is not None else None
+    # A compact result is only usable while its thumbnails are; a hit keeps them fresh
+    cached = result_cache.get(key, lambda r: thumbnail_store.touch(r.get("face_image_ids") or [])) if key else None
+    if cached is not None:
+        os.remove(file_path)
+        result = {**cached, "filename": filename}
+        return jobs.completed(filename, [
+            f"LOG:Identical video already analyzed ({content_hash[:12]}), returning cached result.",
+            f"RESULT:{json.dumps(result)}",
+        ], result)
+
+    try:
+        return jobs.submit(file_path, filename, {"cache_key": key, "sha256": content_hash, "scan_mode": scan_mode,
+                                                 "result_format": result_format})
+    except QueueFull:
+        os.remove(file_path)
+        raise HTTPException(status_code=429, detail="Too many analyses in progress, try again later",
+                            headers={"Retry-After": "30"})
 
 @app.post("/analyze/")
-async def analyze_file(file: UploadFile = File(...)):
+async def analyze_file(file: UploadFile = File(...), scan_mode: str = Form("full"),
+                       result_format: str = Form("inline"), progress_format: str = Form("legacy")):
     """
-    Accepts a file, saves it, and streams the analysis progress.
+    Accepts a file, queues it, and streams the analysis progress.
+    scan_mode "early_exit" or "coarse_to_fine" trades the full probability
+    curve for a faster verdict. result_format "compact" replaces the inline
+    face PNGs with thumbnail IDs for /thumbnails/{id}. progress_format
+    "json" streams typed, coalesced events (see events.py) instead of the
+    LOG:/RESULT: lines.
     """
-    upload_dir = "uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, file.filename)
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # Wrap the generator in a streaming response
-    response = StreamingResponse(run_analysis(file_path), media_type="text/event-stream")
-
-    # The file should be cleaned up after the stream is finished.
-    # FastAPI does not have a direct post-response hook, so this is a bit tricky.
-    # For this example, we'll assume the client closes the connection and we don't clean up,
-    # or we accept that a lot of files will be stored temporarily.
-    # A more robust solution would involve a background task.
+    if progress_format not in PROGRESS_FORMATS:
+        raise HTTPException(status_code=400, detail=f"progress_format must be one of {', '.join(PROGRESS_FORMATS)}")
+    job = await asyncio.to_thread(submit_upload, file, scan_mode, result_format)
+    return StreamingResponse(run_analysis(job, progress_format), media_type="text/event-stream",
+                             headers={"X-Job-Id": job.id})
 
-    return response
+@app.post("/jobs/", status_code=202)
+async def create_job(file: UploadFile = File(...), scan_mode: str = Form("full"),
+                     result_format: str = Form("inline")):
+    """Queues a file for analysis and returns its job ID without waiting."""
+    job = await asyncio.to_thread(submit_upload, file, scan_mode, result_format)
+    return job.summary()
+
+def get_job(job_id: str):
+    job = jobs.get(job_id) if jobs is not None else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+@app.get("/jobs/")
+def list_jobs():
+    return jobs.counts() if jobs is not None else {}
+
+@app.get("/result-cache/")
+def result_cache_stats():
+    if result_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **result_cache.stats()}
+
+@app.get("/engine/")
+def engine_info():
+    """The inference backend in use and its measured drift from eager."""
+    if engine is None:
+        return {"backend": None}
+    return {"backend": engine.backend, "requested": INFERENCE_BACKEND, "parity": engine.parity}
+
+@app.get("/workers/")
+def worker_stats():
+    """Pre-forked inference workers, when INFERENCE_WORKERS is set."""
+    if worker_pool is None:
+        return {"enabled": False}
+    return {"enabled": True, **worker_pool.stats()}
+
+@app.get("/batching/")
+def batching_stats():
+    """Batch sizes, wait times and queue depth of the shared model batchers."""
+    if batched_model is None:
+        return {"enabled": False}
+    return {"enabled": True, **batched_model.stats()}
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics: stage and forward-pass timings, request latency, queue depths."""
+    if not REGISTRY.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    return get_job(job_id).summary()
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, format: str = "legacy", last_event_id: Optional[str] = Header(None)):
+    """
+    Streams a job's progress with event IDs; disconnecting does not cancel it.
+    Starts from the beginning, or after the event named by Last-Event-ID.
+    """
+    job = get_job(job_id)
+    if format not in PROGRESS_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(PROGRESS_FORMATS)}")
+    try:
+        start = min(max(int(last_event_id or 0), 0), len(job.messages))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Last-Event-ID must be an event ID from this stream")
+    if format == "json":
+        stream = json_stream(job, start, PROGRESS_INTERVAL_MS / 1000)
+    else:
+        stream = legacy_stream(job, start, ids=True)
+    return StreamingResponse(timed_stream("/jobs/{job_id}/events", stream), media_type="text/event-stream")
+
+@app.get("/jobs/{job_id}/result")
+def job_result(job_id: str):
+    job = get_job(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.result is None:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return job.result
+
+@app.get("/jobs/{job_id}/probabilities")
+def job_probabilities(job_id: str, dtype: str = "float32"):
+    """Window probabilities as a little-endian array: float32, or uint16 scaled to 0-65535."""
+    probs = np.asarray(job_result(job_id)["probabilities"], dtype=np.float32)
+    if dtype == "float32":
+        data = probs.astype("<f4").tobytes()
+    elif dtype == "uint16":
+        data = np.round(np.clip(probs, 0, 1) * 65535).astype("<u2").tobytes()
+    else:
+        raise HTTPException(status_code=400, detail="dtype must be float32 or uint16")
+    return Response(content=data, media_type="application/octet-stream",
+                    headers={"X-Window-Count": str(len(probs)), "X-Dtype": dtype})
+
+@app.get("/thumbnails/{thumbnail_id}")
+def thumbnail(thumbnail_id: str):
+    found = thumbnail_store.path(thumbnail_id) if thumbnail_store is not None else None
+    if found is None:
+        raise HTTPException(status_code=404, detail="Unknown thumbnail")
+    # IDs are content hashes, so a thumbnail never changes
+    return FileResponse(found[0], media_type=found[1],
+                        headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+def report_faces(result):
+    """Thumbnail bytes for a compact result, or None to use its inline images."""
+    ids = result.get("face_image_ids")
+    if not ids or result.get("face_images_b64") or thumbnail_store is None:
+        return None
+    return thumbnail_store.load(ids)
+
+@app.get("/jobs/{job_id}/report")
+async def job_report(job_id: str):
+    """PDF report of a finished job, built from the face crops the server already holds."""
+    result = job_result(job_id)
+    pdf_bytes = await asyncio.to_thread(report_cache.get_or_generate, result, report_faces(result))
+    return Response(content=pdf_bytes, media_type='application/pdf', headers=REPORT_HEADERS)
+
+@app.get("/reports/")
+def report_cache_stats():
+    return report_cache.stats()
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    job = get_job(job_id)
+    jobs.cancel(job)
+    return job.summary()
+
+def _under(path, prefix, sep):
+    """Whether `path` is `prefix` or inside it, on whole path segments."""
+    prefix = prefix.rstrip(sep)
+    return path == prefix or path.startswith(prefix + sep)
+
+def live_source_allowed(source):
+    """Whether `source` falls under one of the LIVE_SOURCES prefixes.
+
+    File paths must lie inside an allowed directory (or be an allowed file);
+    URLs must match an allowed URL's scheme and host exactly, and its path
+    on whole segments.
+    """
+    if "://" not in source:
+        source = os.path.realpath(source)
+        return any(_under(source, os.path.realpath(prefix), os.sep) for prefix in LIVE_SOURCES if "://" not in prefix)
+    url = urlsplit(source)
+    for prefix in LIVE_SOURCES:
+        if "://" not in prefix:
+            continue
+        allowed = urlsplit(prefix)
+        if (url.scheme.lower(), url.netloc.lower()) == (allowed.scheme.lower(), allowed.netloc.lower()) \
+                and _under(url.path or "/", allowed.path or "/", "/"):
+            return True
+    return False
+
+def decode_frame(data):
+    """RGB array from an encoded (JPEG, PNG, WebP) image."""
+    return np.array(Image.open(io.BytesIO(data)).convert("RGB"))
+
+@app.websocket("/live/")
+async def live_analysis(websocket: WebSocket):
+    """
+    Scores a live feed window by window.
+    The first message is JSON: {"source": <URL or path>, "follow": true}
+    reads a source allowed by LIVE_SOURCES on the server, while
+    {"filename": <name>} expects frames: one encoded image per binary
+    message, then the text "end". Every scored window is sent as
+    {"type": "window", ...} with the running verdict and its latency, and
+    the analysis ends with {"type": "result", "result": {...}}.
+    """
+    global live_sessions
+    await websocket.accept()
+    if jobs is None or live_sessions >= MAX_LIVE_SESSIONS:
+        await websocket.close(code=1013, reason="Live analysis is unavailable, try again later")
+        return
+    live_sessions += 1
+    frames = None
+    try:
+        start = await websocket.receive_json()
+        result_format = start.get("result_format", "inline")
+        if result_format not in RESULT_FORMATS:
+            await websocket.close(code=1008, reason=f"result_format must be one of {', '.join(RESULT_FORMATS)}")
+            return
+        cfg = {**CONFIG, "result_format": result_format}
+        source = start.get("source")
+        if source is not None and not live_source_allowed(source):
+            await websocket.close(code=1008, reason="Source is not allowed")
+            return
+        analyzer = IncrementalAnalyzer(batched_model or engine, cfg,
+                                       sample_every_n=1 if source is not None else None,
+                                       thumbnails=thumbnail_store)
+
+        if source is not None:
+            frames = live_frames(source, cfg, bool(start.get("follow")))
+            def step():
+                frame = next(frames, None)
+                return None if frame is None else analyzer.push(frame)
+            while (windows := await asyncio.to_thread(step)) is not None:
+                for window in windows:
+                    await websocket.send_json({"type": "window", **window})
+        else:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                if message.get("bytes") is not None:
+                    try:
+                        frame = await asyncio.to_thread(decode_frame, message["bytes"])
+                    except Exception as e:
+                        await websocket.send_json({"type": "error", "detail": f"Unreadable frame: {str(e)}"})
+                        continue
+                    for window in await asyncio.to_thread(analyzer.push, frame):
+                        await websocket.send_json({"type": "window", **window})
+                elif message.get("text") == "end":
+                    break
+
+        result = await asyncio.to_thread(analyzer.result, os.path.basename(source or start.get("filename") or "live"))
+        await websocket.send_json({"type": "result", "result": result})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        with suppress(Exception):
+            await websocket.send_json({"type": "error", "detail": str(e)})
+            await websocket.close(code=1011)
+    finally:
+        live_sessions -= 1
+        if frames is not None:
+            frames.close()
 
 class AnalysisResult(BaseModel):
     filename: str
@@ -76,18 +562,21 @@ class AnalysisResult(BaseModel):
     confidence: float
     probabilities: List[float]
     face_images_b64: List[str] = []
+    face_image_ids: List[str] = []
+    result_format: Optional[str] = None
     total_frames: Optional[int] = None
     video_duration_seconds: Optional[float] = None
     windows_analyzed: Optional[int] = None
+    scan_mode: Optional[str] = None
+    window_starts: Optional[List[int]] = None
+    early_exit: Optional[bool] = None
 
 @app.post("/generate-report/")
 async def generate_report_endpoint(result: AnalysisResult):
-    pdf_bytes = bytes(generate_report(result.dict()))
-    
-    headers = {
-        'Content-Disposition': 'attachment; filename="deepfake_report.pdf"'
-    }
-    return Response(content=pdf_bytes, media_type='application/pdf', headers=headers)
+    """PDF report of a result sent by the client; GET /jobs/{job_id}/report avoids the upload."""
+    result = result.dict()
+    pdf_bytes = await asyncio.to_thread(report_cache.get_or_generate, result, report_faces(result))
+    return Response(content=pdf_bytes, media_type='application/pdf', headers=REPORT_HEADERS)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,15 +1,24 @@
-import cv2
-import face_recognition
 import av
+import cv2
 import torch
 import torch.nn as nn
 import timm
-import torchvision.transforms as T
+import torch.nn.functional as F
 import numpy as np
 from PIL import Image
 import json
 import base64
 import io
+import os
+import bisect
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError
+from concurrent.futures.process import BrokenProcessPool
+import queue
+import time
+import metrics
+from face_tracker import FaceTracker, detect_face, detection_pool, discard_detection_pool
+from pipeline import Pipeline
 
 # 2. Configuration
 CONFIG = {
@@ -19,9 +28,75 @@ CONFIG = {
     "temporal_heads": 8,
     # Sliding-window parameters
     "window_size": 16,
-    "window_stride": 8
+    "window_stride": 8,
+    # Backbone embeddings kept per video so overlapping windows reuse them
+    "embedding_cache_frames": 64,
+    # Reuse the last encoded frame's embedding for frames whose 16x16 grayscale
+    # thumbnail differs from it by less than this mean absolute difference
+    # (0-1 scale; 0 disables, ~0.01 catches frozen and near-static frames)
+    "dedup_threshold": 0.0,
+    # Windows stacked into one (B, T, C, H, W) forward pass; "auto" sizes from free memory
+    "windows_per_batch": "auto",
+    "max_windows_per_batch": 8,
+    # Face localization: detect on a downscaled frame, track in between
+    "face_detect_max_side": 640,
+    "face_redetect_every": 8,
+    "face_track_min_confidence": 0.6,
+    # Decoding: FFmpeg threads (0 = auto), working resolution (longest side,
+    # None = native) and temporal subsampling (keep every n-th frame, or
+    # enough frames to reach target_fps)
+    "decode_threads": 0,
+    "decode_max_side": None,
+    "sample_every_n": 1,
+    "target_fps": None,
+    # Run decode, face detection and preprocessing in their own threads with
+    # bounded queues between them; keyframe HOG detection goes to a process pool
+    "pipeline": True,
+    "pipeline_queue_depth": 4,
+    "face_detect_workers": 2,
+    # Scan mode: "full" scores every window; "early_exit" stops at the first
+    # window over DEEPFAKE_THRESHOLD; "coarse_to_fine" also stops early, but
+    # first scores only every coarse_stride-th frame's window and adds the
+    # dense windows around any that reach refine_threshold
+    "scan_mode": "full",
+    "coarse_stride": 32,
+    "refine_threshold": 0.025,
+    # Emit STATS: progress events (stage, cumulative timings, windows scored
+    # since the previous event) alongside the LOG: lines
+    "timing_events": True,
+    # "compact" results carry capped face thumbnails by ID instead of inline PNGs
+    "result_format": "inline",
+    "thumbnail_size": 160,
+    "thumbnail_format": "JPEG",
+    "thumbnail_max_bytes": 16384,
+    # Live analysis: frames encoded together while waiting for a window to fill
+    "live_encode_batch": 4
 }
 
+SCAN_MODES = ("full", "early_exit", "coarse_to_fine")
+RESULT_FORMATS = ("inline", "compact")
+THUMBNAIL_MEDIA_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+# Verdict rule: deepfake above DEEPFAKE_THRESHOLD or inside SUSPECT_BAND
+DEEPFAKE_THRESHOLD = 0.5
+SUSPECT_BAND = (0.025, 0.03)
+
+def deepfake_verdict(max_prob, threshold=DEEPFAKE_THRESHOLD, suspect_band=SUSPECT_BAND):
+    return suspect_band[0] < max_prob < suspect_band[1] or max_prob > threshold
+
+# Instrumentation, exported at /metrics; updates are no-ops while metrics are disabled
+STAGE_SECONDS = metrics.REGISTRY.histogram(
+    "deepfake_stage_seconds", "Busy seconds of one analysis per stage (inference includes backbone and temporal)", ["stage"])
+FORWARD_SECONDS = metrics.REGISTRY.histogram("deepfake_forward_seconds", "Duration of one model call, including any micro-batching wait", ["part"])
+ANALYSIS_SECONDS = metrics.REGISTRY.histogram("deepfake_analysis_seconds", "Wall time of one completed analysis")
+FRAMES_TOTAL = metrics.REGISTRY.counter("deepfake_frames_total", "Frames by processing step", ["step"])
+WINDOWS_TOTAL = metrics.REGISTRY.counter("deepfake_windows_total", "Windows scored")
+FACE_LOCALIZATIONS_TOTAL = metrics.REGISTRY.counter(
+    "deepfake_face_localizations_total", "Frames localized, by method", ["method"])
+
+# Rough peak inference memory per frame of a ViT-B/16 forward pass (activations + input)
+WINDOW_FRAME_BYTES = 24 * 2**20
+
 # 3. Device setup
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 torch.manual_seed(42); np.random.seed(42)
@@ -29,9 +104,9 @@ if torch.cuda.is_available(): torch.cuda.manual_seed_all(42)
 
 # 4. Model definitions
 class ViTVisualEncoder(nn.Module):
-    def __init__(self, name):
+    def __init__(self, name, pretrained=True):
         super().__init__()
-        m = timm.create_model(name, pretrained=True, num_classes=0)
+        m = timm.create_model(name, pretrained=pretrained, num_classes=0)
         self.backbone = m; self.dim = m.num_features
     def forward(self, x):
         B,T,C,H,W = x.shape
@@ -57,30 +132,520 @@ class ClassificationHead(nn.Module):
         return self.fc(pooled).squeeze(1)
 
 class VisualOnlyM3TNet(nn.Module):
-    def __init__(self, cfg):
+    def __init__(self, cfg, pretrained=True):
         super().__init__()
-        self.visual = ViTVisualEncoder(cfg['vision_model_name'])
+        self.visual = ViTVisualEncoder(cfg['vision_model_name'], pretrained)
         self.temp   = TimeseriesTransformer(self.visual.dim, cfg['temporal_layers'], cfg['temporal_heads'])
         self.head   = ClassificationHead(self.visual.dim)
     def forward(self, x): return self.head(self.temp(self.visual(x)))
+    def encode(self, x):
+        """Backbone embeddings for a flat (N, C, H, W) batch of frames."""
+        return self.visual.backbone(x)
+    def score(self, emb):
+        """Window logits from (B, T, D) per-frame embeddings."""
+        return self.head(self.temp(emb))
 
-def get_model(model_path: str):
-    model = VisualOnlyM3TNet(CONFIG).to(device)
-    state = torch.load(model_path, map_location=device)
+class TemporalScorer(nn.Module):
+    """The temporal encoder and head of VisualOnlyM3TNet alone, for scoring stored embeddings."""
+    def __init__(self, cfg, dim):
+        super().__init__()
+        self.temp = TimeseriesTransformer(dim, cfg['temporal_layers'], cfg['temporal_heads'])
+        self.head = ClassificationHead(dim)
+    def score(self, emb):
+        """Window logits from (B, T, D) per-frame embeddings."""
+        return self.head(self.temp(emb))
+
+# 5. Frame preprocessing
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+class FramePreprocessor:
+    """Crop, resize and ImageNet-normalize frames into a reused buffer.
+
+    Each crop is resized once with antialiased bicubic interpolation on uint8
+    (matching PIL's default resize) into a uint8 staging buffer; the BGR->RGB
+    flip (for BGR input), float conversion and normalization then run over
+    the whole batch.
+    The staging buffer is always reused. With `reuse` the output buffer is
+    too, so the returned tensor is only valid until the next call; without
+    it every call returns a new tensor the caller owns.
+    """
+    def __init__(self, size, channel_order='rgb', reuse=True):
+        self.size = size
+        self.channel_order = channel_order
+        self.reuse = reuse
+        self.mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1) * 255
+        self.std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1) * 255
+        self._staging = None
+        self._out = None
+    def _buffers(self, n):
+        if self._staging is None or self._staging.shape[0] < n:
+            self._staging = torch.empty((n, 3, self.size, self.size), dtype=torch.uint8)
+            self._out = None
+        if not self.reuse:
+            return self._staging[:n], torch.empty((n, 3, self.size, self.size), dtype=torch.float32)
+        if self._out is None:
+            self._out = torch.empty((self._staging.shape[0], 3, self.size, self.size), dtype=torch.float32)
+        return self._staging[:n], self._out[:n]
+    def __call__(self, frames, boxes):
+        """frames: HxWx3 uint8 arrays; boxes: (top, right, bottom, left) or None per frame."""
+        staging, out = self._buffers(len(frames))
+        for j, (img, box) in enumerate(zip(frames, boxes)):
+            if box is not None:
+                t,r,b,l = box; img = img[t:b, l:r]
+            x = torch.from_numpy(img).permute(2, 0, 1).unsqueeze(0)
+            staging[j] = F.interpolate(x, size=(self.size, self.size), mode='bicubic', antialias=True)[0]
+        out.copy_(staging.flip(1) if self.channel_order == 'bgr' else staging)
+        return out.sub_(self.mean).div_(self.std)
+
+# 6. Per-frame embedding cache
+class FrameEmbeddingCache:
+    """Bounded LRU of per-frame backbone embeddings keyed by frame index.
+
+    Every frame is cropped with its own face box, so its embedding is the
+    same for all windows that contain it.
+    """
+    def __init__(self, capacity):
+        self.capacity = max(1, int(capacity))
+        self._store = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    def __contains__(self, key): return key in self._store
+    def __len__(self): return len(self._store)
+    def get(self, key):
+        emb = self._store.get(key)
+        if emb is None:
+            self.misses += 1
+            return None
+        self._store.move_to_end(key)
+        self.hits += 1
+        return emb
+    def put(self, key, emb):
+        self._store[key] = emb
+        self._store.move_to_end(key)
+        while len(self._store) > self.capacity:
+            self._store.popitem(last=False)
+
+class FrameDeduplicator:
+    """Skips the backbone for frames nearly identical to the last encoded one.
+
+    Each preprocessed frame is reduced to a `size` x `size` grayscale
+    thumbnail; if its mean absolute difference from the thumbnail of the
+    last frame actually encoded is below `threshold`, that frame's
+    embedding is reused. Comparing against the encoded reference, not the
+    previous frame, keeps slow drift from accumulating.
+    """
+    def __init__(self, threshold, size=16):
+        self.threshold = threshold
+        self.size = size
+        self.mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+        self.std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+        self.ref = None
+        self.ref_emb = None
+        self.frames = 0
+        self.reused = 0
+    def signatures(self, batch):
+        """(N, size*size) grayscale thumbnails in 0-1 of a normalized (N, 3, H, W) batch."""
+        gray = (batch.cpu() * self.std + self.mean).mean(1, keepdim=True)
+        return F.adaptive_avg_pool2d(gray, self.size).flatten(1)
+    def encode(self, batch, encode_fn):
+        """Embeddings for every row of `batch`, calling `encode_fn` only on rows unlike their reference."""
+        if self.threshold <= 0:
+            self.frames += len(batch)
+            return encode_fn(batch)
+        keep, source = [], []
+        ref = self.ref
+        for j, sig in enumerate(self.signatures(batch)):
+            if ref is None or (sig - ref).abs().mean() >= self.threshold:
+                keep.append(j)
+                ref = sig
+            # Index of the reference embedding among the encoded rows; -1 is the previous batch's
+            source.append(len(keep) - 1)
+        emb = encode_fn(batch[keep]) if keep else None
+        out = [emb[k] if k >= 0 else self.ref_emb for k in source]
+        self.ref = ref
+        if keep:
+            self.ref_emb = emb[-1]
+        self.frames += len(source)
+        self.reused += len(source) - len(keep)
+        return out
+    def stats(self):
+        return {"threshold": self.threshold, "frames_reused": self.reused,
+                "skip_fraction": round(self.reused / self.frames, 4) if self.frames else 0.0}
+
+# Marks a checkpoint written by save_ready_model
+READY_FORMAT = "m3tnet-ready-v1"
+ARCHITECTURE_KEYS = ("vision_model_name", "temporal_layers", "temporal_heads")
+
+def load_checkpoint(model_path: str):
+    """Checkpoint contents on the CPU, memory-mapped unless the file predates the zip format."""
+    try:
+        return torch.load(model_path, map_location='cpu', mmap=True, weights_only=True)
+    except RuntimeError:
+        return torch.load(model_path, map_location='cpu', weights_only=True)
+
+def model_state_dict(model_path: str):
+    """The checkpoint's weights under VisualOnlyM3TNet's parameter names."""
+    state = load_checkpoint(model_path)
+    if state.get('format') == READY_FORMAT:
+        arch = {k: CONFIG[k] for k in ARCHITECTURE_KEYS}
+        if state['config'] != arch:
+            raise ValueError(f"{model_path} was prepared for {state['config']}, CONFIG expects {arch}")
+        return state['state_dict']
     st = state.get('state_dict', state)
     clean = {k.replace('module.',''): v for k,v in st.items()}
     # remap cls->head if necessary
-    clean = {kk.replace('cls.pool.attn.','head.attn.').replace('cls.fc.','head.fc.'): vv for kk,vv in clean.items()}
-    model.load_state_dict(clean)
+    return {kk.replace('cls.pool.attn.','head.attn.').replace('cls.fc.','head.fc.'): vv for kk,vv in clean.items()}
+
+def get_model(model_path: str):
+    clean = model_state_dict(model_path)
+    # Build the architecture on the meta device: no pretrained download and no
+    # random init, the (memory-mapped) checkpoint tensors are used in place
+    with torch.device('meta'):
+        model = VisualOnlyM3TNet(CONFIG, pretrained=False)
+    model.load_state_dict(clean, assign=True)
+    model = model.to(device)
     model.eval()
     return model
 
-# 6. Sliding-window inference
-def sliding_window_inference(model: nn.Module, video_path: str, cfg=CONFIG):
-    # Decode all frames
+def get_scorer(model_path: str):
+    """The checkpoint's temporal encoder and head, without building or loading the backbone."""
+    clean = model_state_dict(model_path)
+    parts = {k: v for k, v in clean.items() if k.startswith(('temp.', 'head.'))}
+    with torch.device('meta'):
+        scorer = TemporalScorer(CONFIG, parts['head.fc.weight'].shape[1])
+    scorer.load_state_dict(parts, assign=True)
+    scorer = scorer.to(device)
+    scorer.eval()
+    return scorer
+
+def save_ready_model(model_path: str, out_path: str):
+    """Write `model_path` as a ready-to-run checkpoint: remapped keys, weights only, mmap-friendly."""
+    model = get_model(model_path)
+    state = {k: v.detach().to('cpu').contiguous() for k, v in model.state_dict().items()}
+    torch.save({'format': READY_FORMAT, 'config': {k: CONFIG[k] for k in ARCHITECTURE_KEYS},
+                'state_dict': state}, out_path)
+
+# 7. Streaming helpers
+def configure_decoder(stream, cfg):
+    """Enable FFmpeg's frame/slice threading; 0 threads lets FFmpeg pick."""
+    threads = cfg['decode_threads']
+    if threads != 1:
+        stream.thread_type = "AUTO"
+        stream.codec_context.thread_count = threads
+
+def decode_plan(stream, cfg):
+    """Which frames to convert and at what size, from the decode settings in cfg."""
+    source_fps = float(stream.average_rate) if stream.average_rate else 0.0
+    step = max(1, int(cfg['sample_every_n']))
+    if cfg['target_fps'] and source_fps > cfg['target_fps']:
+        step = max(step, round(source_fps / cfg['target_fps']))
+    w, h = stream.codec_context.width, stream.codec_context.height
+    max_side = cfg['decode_max_side']
+    if max_side and max(w, h) > max_side:
+        scale = max_side / max(w, h)
+        # Even dimensions keep swscale happy with subsampled chroma
+        w, h = max(2, round(w * scale / 2) * 2), max(2, round(h * scale / 2) * 2)
+    return {
+        "source_fps": source_fps,
+        "sample_every_n": step,
+        "effective_fps": source_fps / step,
+        "working_resolution": [w, h],
+    }
+
+def iter_frames(cont, stream, plan, counts, decoded=None):
+    """Stage: decode frames one at a time so only in-flight frames stay in memory.
+
+    Skipped frames are decoded (later frames depend on them) but never
+    converted. Kept frames are scaled and converted to RGB by swscale in
+    a single pass. `decoded` replaces cont.decode(stream) as the frame source.
+    """
+    w, h = plan['working_resolution']
+    scaled = [w, h] != [stream.codec_context.width, stream.codec_context.height]
+    kwargs = {"width": w, "height": h, "interpolation": "AREA"} if scaled else {}
+    for n, frame in enumerate(decoded if decoded is not None else cont.decode(stream)):
+        counts['decoded'] += 1
+        if n % plan['sample_every_n']: continue
+        counts['analyzed'] += 1
+        yield frame.to_ndarray(format='rgb24', **kwargs)
+
+def localize_frames(frames, tracker, cfg, logs, pool=None, workers=0):
+    """Stage: attach a face box to every frame that falls inside some window.
+
+    Yields (frame_idx, frame, box, crop), where crop is the face of a window's
+    first frame, kept for the report. With a detection pool of `workers`
+    processes, keyframe detections are submitted ahead of time so several
+    run in parallel while the frames before them are tracked. If the pool
+    breaks (a worker died), it is discarded and detection continues inline.
+    """
+    wsize, stride = cfg['window_size'], cfg['window_stride']
+    ahead = tracker.redetect_every * workers if pool is not None else 0
+    lookahead = deque()
+
+    def drop_pool():
+        nonlocal pool
+        if pool is not None:
+            logs.put("LOG:Face detection pool broke, detecting inline")
+            discard_detection_pool(pool)
+            pool = None
+
+    def finish(idx, frame, small, detection):
+        if detection is not None:
+            try:
+                detection.result()
+            except (BrokenProcessPool, CancelledError):
+                drop_pool()
+                detection = None  # locate detects inline instead
+            except Exception:
+                pass  # locate raises it again and it is logged below
+        box = None
+        try:
+            box = tracker.locate(idx, frame, small, detection)
+        except Exception as e:
+            logs.put(f"LOG:Face detection failed for frame {idx}: {str(e)}")
+        crop = None
+        if box is not None and idx % stride == 0:
+            t,r,b,l = box
+            # Copy so the kept crop does not pin the whole frame in memory
+            crop = frame[t:b, l:r].copy()
+        return idx, frame, box, crop
+
+    for idx, frame in enumerate(frames):
+        if idx % stride >= wsize: continue
+        small = detection = None
+        if pool is not None and tracker.is_keyframe(idx):
+            small, _ = tracker.downscale(frame)
+            try:
+                detection = pool.submit(detect_face, tracker.detection_input(small))
+            except BrokenProcessPool:
+                drop_pool()
+        lookahead.append((idx, frame, small, detection))
+        if len(lookahead) > ahead:
+            yield finish(*lookahead.popleft())
+    while lookahead:
+        yield finish(*lookahead.popleft())
+
+def preprocess_chunks(located, size, chunk, logs):
+    """Stage: group located frames into chunks of `chunk` normalized frames.
+
+    Yields (items, batch) with items = [(frame_idx, box, crop)], or a None
+    batch if preprocessing failed. Each batch is a new tensor owned by the
+    consumer, so only the batches actually queued or in use hold memory.
+    """
+    preprocess = FramePreprocessor(size, reuse=False)
+    items, frames = [], []
+    def flush():
+        try:
+            return items, preprocess(frames, [box for _, box, _ in items])
+        except Exception as e:
+            logs.put(f"LOG:Preprocessing failed for frames {items[0][0]}-{items[-1][0]}: {str(e)}")
+            return items, None
+    for idx, frame, box, crop in located:
+        items.append((idx, box, crop))
+        frames.append(frame)
+        if len(items) == chunk:
+            yield flush()
+            items, frames = [], []
+    if items:
+        yield flush()
+
+def drain(logs):
+    """Yield messages queued by the worker stages."""
+    while True:
+        try:
+            yield logs.get_nowait()
+        except queue.Empty:
+            return
+
+class FaceCandidates:
+    """Face crops for the report: highest, lowest and median window probability.
+
+    Only those crops are needed at the end, so instead of one crop per window
+    we keep the current extremes plus a small pool of crops whose probability
+    is nearest the running median.
+    """
+    def __init__(self, pool_size=8):
+        self.pool_size = pool_size
+        self.highest = None
+        self.lowest = None
+        self.pool = []
+        self.sorted_probs = []
+    def add(self, prob, crop):
+        if crop is None: return
+        bisect.insort(self.sorted_probs, prob)
+        if self.highest is None or prob >= self.highest[0]: self.highest = (prob, crop)
+        if self.lowest is None or prob < self.lowest[0]: self.lowest = (prob, crop)
+        self.pool.append((prob, crop))
+        if len(self.pool) > self.pool_size:
+            median = self.median()
+            self.pool.remove(max(self.pool, key=lambda pc: abs(pc[0] - median)))
+    def median(self):
+        return self.sorted_probs[len(self.sorted_probs) // 2]
+    def crops(self):
+        """Unique crops in report order: highest, lowest, median."""
+        picks = []
+        if self.highest is not None: picks.append(self.highest[1])
+        if len(self.sorted_probs) > 1: picks.append(self.lowest[1])
+        if len(self.sorted_probs) > 2:
+            median = self.median()
+            picks.append(min(self.pool, key=lambda pc: abs(pc[0] - median))[1])
+        unique_faces, face_keys = [], set()
+        for crop in picks:
+            crop_bytes = crop.tobytes()
+            if crop_bytes not in face_keys:
+                unique_faces.append(crop)
+                face_keys.add(crop_bytes)
+        return unique_faces
+
+class WindowSchedule:
+    """Window start frames to score under a scan mode.
+
+    "full" and "early_exit" score every `window_stride`-th start.
+    "coarse_to_fine" scores every `coarse_stride`-th start and, once one of
+    those reaches `refine_threshold`, schedules the dense starts within one
+    coarse step of it on either side. Starts are handed out by `ready` as
+    soon as their last frame has arrived, refinements behind the current
+    frame included.
+    """
+    def __init__(self, cfg):
+        self.mode = cfg.get('scan_mode', 'full')
+        if self.mode not in SCAN_MODES:
+            raise ValueError(f"Unknown scan_mode {self.mode!r}, expected one of {', '.join(SCAN_MODES)}")
+        self.wsize, self.stride = cfg['window_size'], cfg['window_stride']
+        self.coarse = self.stride
+        if self.mode == "coarse_to_fine":
+            self.coarse = max(self.stride, cfg['coarse_stride'] // self.stride * self.stride)
+        self.refine_threshold = cfg['refine_threshold']
+        self.early_exit = self.mode != "full"
+        self.refined = set()
+        self.scored = set()
+        self._next = 0  # first coarse start not handed out yet
+
+    def wanted(self, start):
+        return start >= 0 and start % self.stride == 0 and (start % self.coarse == 0 or start in self.refined)
+
+    def needs(self, idx):
+        """Whether frame `idx` lies in a window scheduled so far."""
+        first = max(0, idx - self.wsize + 1)
+        first += -first % self.stride
+        return any(self.wanted(s) for s in range(first, idx + 1, self.stride))
+
+    def ready(self, last_idx):
+        """Scheduled, unscored starts whose windows end by frame `last_idx`."""
+        end = last_idx - self.wsize + 1
+        starts = [s for s in self.refined if s <= end and s not in self.scored]
+        while self._next <= end:
+            if self._next not in self.scored: starts.append(self._next)
+            self._next += self.coarse
+        return sorted(set(starts))
+
+    def record(self, start, prob):
+        """Mark `start` scored; returns the starts newly scheduled around it."""
+        self.scored.add(start)
+        if self.coarse == self.stride or start % self.coarse or prob < self.refine_threshold:
+            return []
+        new = [s for s in range(max(0, start - self.coarse + self.stride), start + self.coarse, self.stride)
+               if s % self.coarse and s not in self.refined]
+        self.refined.update(new)
+        return new
+
+def available_memory_bytes():
+    """Free memory on the inference device, or None when it cannot be determined."""
+    if device.type == 'cuda':
+        return torch.cuda.mem_get_info(device)[0]
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def resolve_windows_per_batch(cfg, concurrency=1):
+    """Number of windows stacked per forward pass.
+
+    "auto" sizes it from a quarter of the free memory, split between the
+    `concurrency` analyses that may run at once. Servers resolve it once at
+    startup, so analyses running together do not each claim the same free
+    memory.
+    """
+    n = cfg['windows_per_batch']
+    if n != "auto":
+        return max(1, int(n))
+    free = available_memory_bytes()
+    if free is None:
+        return 1
+    per_window = cfg['window_size'] * WINDOW_FRAME_BYTES
+    return max(1, min(cfg['max_windows_per_batch'], int(free * 0.25 / max(1, concurrency)) // per_window))
+
+# 8. Sliding-window inference
+def encode_face_images(crops):
+    """Base64 PNGs of the report face crops."""
+    face_images_b64 = []
+    for crop in crops:
+        pil_img = Image.fromarray(crop)
+        buff = io.BytesIO()
+        pil_img.save(buff, format="PNG")
+        face_images_b64.append(base64.b64encode(buff.getvalue()).decode("utf-8"))
+    return face_images_b64
+
+def encode_thumbnail(crop, max_side=160, fmt="JPEG", max_bytes=16384):
+    """A face crop downscaled to fit `max_side` and encoded under `max_bytes` where possible."""
+    img = Image.fromarray(crop)
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+    while True:
+        for quality in (85, 70, 55, 40):
+            buff = io.BytesIO()
+            img.save(buff, format=fmt, quality=quality)
+            if buff.tell() <= max_bytes:
+                return buff.getvalue()
+        if max(img.size) <= 32:
+            return buff.getvalue()
+        img = img.resize((max(1, img.width * 3 // 4), max(1, img.height * 3 // 4)), Image.LANCZOS)
+
+def face_image_fields(crops, cfg, thumbnails=None):
+    """(face_images_b64, face_image_ids) for a result's report face crops.
+
+    Compact results store thumbnails in `thumbnails` and list their IDs,
+    or inline them when there is no store; inline results carry PNGs.
+    """
+    if cfg['result_format'] != "compact":
+        return encode_face_images(crops), []
+    fmt = cfg['thumbnail_format']
+    thumbs = [encode_thumbnail(crop, cfg['thumbnail_size'], fmt, cfg['thumbnail_max_bytes']) for crop in crops]
+    if thumbnails is not None:
+        return [], [thumbnails.put(t, THUMBNAIL_MEDIA_TYPES[fmt]) for t in thumbs]
+    return [base64.b64encode(t).decode("utf-8") for t in thumbs], []
+
+def compact_probabilities(probs):
+    """Probabilities at float32 precision, the model's own, so JSON carries ~10 digits instead of 17."""
+    return [float(str(p)) for p in np.asarray(probs, dtype=np.float32)]
+
+def sliding_window_inference(model: nn.Module, video_path: str, cfg=CONFIG, filename=None, thumbnails=None,
+                             embedding_store=None):
+    """Yields LOG: progress lines, then one RESULT: line with the JSON verdict.
+
+    `model` is a VisualOnlyM3TNet or any object with the same encode/score
+    methods, such as batching.BatchedModel. `filename` is the name reported
+    in the result, when it differs from the path being read. With
+    cfg["result_format"] == "compact", face thumbnails go to `thumbnails`
+    (an object with put(data, media_type) -> ID, such as
+    result_cache.ThumbnailStore) and the result lists their IDs. With an
+    `embedding_store` (embedding_store.EmbeddingStore), every frame's
+    backbone embedding and face box are saved for re-scoring and the result
+    names the stored entry.
+    """
     yield "LOG:Decoding video frames..."
+    writer = embedding_store.writer(video_path) if embedding_store is not None else None
     cont = av.open(video_path)
+    try:
+        yield from _stream_windows(model, cont, filename or video_path, cfg, thumbnails, writer)
+    finally:
+        cont.close()
+        if writer is not None:
+            writer.discard()
+
+def _stream_windows(model, cont, filename, cfg, thumbnails=None, writer=None):
     stream = cont.streams.video[0]
+    configure_decoder(stream, cfg)
+    plan = decode_plan(stream, cfg)
     total_frames = stream.frames if stream.frames is not None else 0
 
     duration_sec = 0
@@ -88,128 +653,429 @@ def sliding_window_inference(model: nn.Module, video_path: str, cfg=CONFIG):
         duration_sec = float(stream.duration * stream.time_base)
 
     yield f"LOG:Video duration: {duration_sec:.2f}s, Total frames: {total_frames}"
+    w, h = plan['working_resolution']
+    yield (f"LOG:Sampling every {plan['sample_every_n']} frame(s) "
+           f"({plan['effective_fps']:.2f} of {plan['source_fps']:.2f} fps) at {w}x{h}")
 
-    frames_bgr = []
-    for frame in cont.decode(stream):
-        frames_bgr.append(frame.to_ndarray(format='bgr24'))
-    cont.close()
-    yield f"LOG:Decoded {len(frames_bgr)} frames."
-    # Preprocessing transform
-    tf = T.Compose([
-        T.Resize((cfg['frame_size'],cfg['frame_size'])),
-        T.ToTensor(),
-        T.Normalize([0.485,0.456,0.406],[0.229,0.224,0.225])
-    ])
-    # Slide window
-    window_results = []
+    # Windows are assembled from per-frame embeddings as their last frame is encoded
     wsize, stride = cfg['window_size'], cfg['window_stride']
-    num_windows = len(range(0, len(frames_bgr) - wsize + 1, stride))
-    yield f"LOG:Processing {num_windows} windows..."
-    for i, start in enumerate(range(0, len(frames_bgr) - wsize + 1, stride)):
-        yield f"LOG:  - Analyzing window {i+1}/{num_windows}"
-        window = frames_bgr[start:start+wsize]
-
-        # --- Optimization: Detect face only on the first frame of the window ---
-        first_frame_rgb = cv2.cvtColor(window[0], cv2.COLOR_BGR2RGB)
-        boxes = []
-        try:
-            boxes = face_recognition.face_locations(first_frame_rgb)
-        except Exception as e:
-            yield f"LOG:Face detection failed for window {i+1}: {str(e)}"
-        
-        tensors = []
-        current_face_crop = None
-        if boxes:
+    schedule = WindowSchedule(cfg)
+    bsize = resolve_windows_per_batch(cfg)
+    chunk = bsize * stride
+    # Frames no scheduled window needs yet are kept preprocessed, so coarse
+    # windows refined after the fact can still be encoded
+    lookback = schedule.coarse + wsize + chunk if schedule.coarse != stride else 0
+    depth = cfg['pipeline_queue_depth'] if cfg['pipeline'] else 0
+    workers = cfg['face_detect_workers']
+    pool = detection_pool(workers) if workers else None
+    embeddings = FrameEmbeddingCache(max(cfg['embedding_cache_frames'], wsize + chunk + lookback))
+    tracker = FaceTracker(cfg['face_detect_max_side'], cfg['face_redetect_every'],
+                          cfg['face_track_min_confidence'], cache_frames=wsize + chunk, channel_order='rgb')
+    faces = FaceCandidates()
+    window_crops = {}
+    pending = OrderedDict()
+    probs, window_starts = [], []
+    logs = queue.SimpleQueue()
+    counts = {"decoded": 0, "analyzed": 0, "encoded": 0}
+    dedup = FrameDeduplicator(cfg['dedup_threshold'])
+    forward_s = {"backbone": 0.0, "temporal": 0.0}
+    started = time.perf_counter()
+    stopped_at = None
+    expected = len(range(0, -(-total_frames // plan['sample_every_n']) - wsize + 1, stride))
+    of_expected = f"/{expected}" if expected and schedule.mode != "coarse_to_fine" else ""
+    yield f"LOG:Processing {expected if expected else 'streamed'} windows..."
+    if schedule.mode != "full":
+        yield (f"LOG:Scan mode: {schedule.mode}, stopping at the first window above {DEEPFAKE_THRESHOLD}"
+               + (f"; coarse stride {schedule.coarse}, refining around windows from {schedule.refine_threshold}"
+                  if lookback else ""))
+    yield f"LOG:Batching up to {bsize} windows per forward pass"
+    yield (f"LOG:Pipeline: {'threaded, queue depth ' + str(depth) if depth else 'serial'}, "
+           f"{workers or 'inline'} face detection worker(s)")
+
+    def timed(part, fn, x):
+        t0 = time.perf_counter()
+        with torch.no_grad():
+            out = fn(x)
+        elapsed = time.perf_counter() - t0
+        forward_s[part] += elapsed
+        FORWARD_SECONDS.observe(elapsed, part=part)
+        return out
+
+    reported = 0
+    def progress(stage):
+        """Cumulative counts and timings, plus the windows scored since the last call, for a STATS: event."""
+        nonlocal reported
+        elapsed = time.perf_counter() - started
+        scored = [{"index": k, "start": window_starts[k], "probability": probs[k]} for k in range(reported, len(probs))]
+        reported = len(probs)
+        return {"stage": stage, "frames_analyzed": counts['analyzed'], "frames_encoded": counts['encoded'],
+                "windows": len(probs), "windows_expected": expected if of_expected else None, "scored": scored,
+                "elapsed_s": round(elapsed, 4),
+                "frames_per_s": round(counts['analyzed'] / elapsed, 2) if elapsed else 0.0,
+                "forward_s": {part: round(s, 4) for part, s in forward_s.items()}}
+
+    def encode(idxs, batch):
+        """Run the backbone on `batch` and cache one embedding per frame in `idxs`."""
+        first, last = idxs[0], idxs[-1]
+        yield f"LOG:    Encoding frames {first}-{last}"
+        emb = [None] * len(idxs)
+        if batch is not None:
             try:
-                t,r,b,l = boxes[0]
-                current_face_crop = first_frame_rgb[t:b, l:r]
+                reused = dedup.reused
+                emb = dedup.encode(batch.to(device), lambda x: timed("backbone", model.encode, x))
+                counts['encoded'] += len(idxs) - (dedup.reused - reused)
             except Exception as e:
-                yield f"LOG:Face cropping failed for window {i+1}: {str(e)}"
+                yield f"LOG:Error encoding frames {first}-{last}: {str(e)}"
+        for idx, e in zip(idxs, emb):
+            embeddings.put(idx, e)
+            if writer is not None and e is not None:
+                writer.add(idx, e)
 
+    def score(starts):
+        """Score every window in `starts` with one temporal forward pass."""
+        first = len(probs)
+        label = f"{first+1}-{first+len(starts)}" if len(starts) > 1 else f"{first+1}"
+        for k in range(len(starts)):
+            yield f"LOG:  - Analyzing window {first+k+1}{of_expected}"
+        seqs = [[embeddings.get(idx) for idx in range(start, start + wsize)] for start in starts]
+        complete = [k for k, seq in enumerate(seqs) if all(e is not None for e in seq)]
+        # Use a neutral probability to continue processing
+        window_probs = [0.5] * len(starts)
         try:
-            yield f"LOG:    Processing {len(window)} frames in window {i+1}"
-            for frame_idx, img_bgr in enumerate(window):
-                rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-
-                # Use the bounding box from the first frame for all frames in the window
-                if boxes:
-                    t,r,b,l = boxes[0]; crop = rgb[t:b, l:r]
+            if complete:
+                yield f"LOG:    Running inference on window {label}"
+                batch = torch.stack([torch.stack(seqs[k]) for k in complete])
+                for k, p in zip(complete, torch.sigmoid(timed("temporal", model.score, batch)).tolist()):
+                    window_probs[k] = p
+            for k in range(len(starts)):
+                if k in complete:
+                    yield f"LOG:    Window {first+k+1} completed with probability: {window_probs[k]:.3f}"
                 else:
-                    crop = rgb
-                pil = Image.fromarray(crop).resize((cfg['frame_size'],cfg['frame_size']))
-                tensors.append(tf(pil))
-            
-            yield f"LOG:    Running inference on window {i+1}"
-            batch = torch.stack(tensors).unsqueeze(0).to(device)
-            with torch.no_grad():
-                logit = model(batch)
-                current_prob = float(torch.sigmoid(logit))
-                window_results.append({
-                    "prob": current_prob,
-                    "face_crop": current_face_crop
-                })
-            yield f"LOG:    Window {i+1} completed with probability: {current_prob:.3f}"
+                    yield f"LOG:Error processing window {first+k+1}: missing frame embeddings"
         except Exception as e:
-            yield f"LOG:Error processing window {i+1}: {str(e)}"
-            # Add a default result to continue processing
-            window_results.append({
-                "prob": 0.5,  # neutral probability
-                "face_crop": current_face_crop
-            })
-        
-        # Clean up memory after each window
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-        del tensors
-        if 'batch' in locals():
-            del batch
+            yield f"LOG:Error processing window {label}: {str(e)}"
+            window_probs = [0.5] * len(starts)
+        for start, p in zip(starts, window_probs):
+            probs.append(p)
+            window_starts.append(start)
+            faces.add(p, window_crops.pop(start, None))
+            refined = schedule.record(start, p)
+            if refined:
+                yield f"LOG:    Refining around frame {start}: windows at frames {refined[0]}-{refined[-1]}"
+
+    if cfg['timing_events']:
+        yield "STATS:" + json.dumps(progress("decode"))
+    pipe = Pipeline(depth)
+    try:
+        frames = pipe.stage("decode", lambda _: iter_frames(cont, stream, plan, counts))
+        located = pipe.stage("face_detection", lambda src: localize_frames(src, tracker, cfg, logs, pool, workers), frames)
+        batches = pipe.stage("preprocess", lambda src: preprocess_chunks(src, cfg['frame_size'], chunk, logs), located)
+        for items, batch in pipe.consume(batches, "inference"):
+            yield from drain(logs)
+            idxs = [idx for idx, _, _ in items]
+            for idx, box, crop in items:
+                if idx % stride == 0:
+                    window_crops[idx] = crop
+                if writer is not None:
+                    writer.box(idx, box)
+            needed = [j for j, idx in enumerate(idxs) if schedule.needs(idx)]
+            if batch is None or len(needed) == len(idxs):
+                yield from encode(idxs, batch)
+            else:
+                for j, idx in enumerate(idxs):
+                    if j not in needed:
+                        pending[idx] = batch[j].clone()
+                if needed:
+                    yield from encode([idxs[j] for j in needed], batch[needed])
+            # Forget frames and crops no refinement can reach any more
+            horizon = idxs[-1] - lookback
+            while pending and next(iter(pending)) < horizon:
+                pending.popitem(last=False)
+            for start in [s for s in window_crops if s < horizon - wsize]:
+                del window_crops[start]
+
+            while stopped_at is None:
+                ready = schedule.ready(idxs[-1])
+                if not ready: break
+                late = sorted({idx for start in ready for idx in range(start, start + wsize) if idx in pending})
+                if late:
+                    yield from encode(late, torch.stack([pending.pop(idx) for idx in late]))
+                scored = len(probs)
+                yield from score(ready)
+                if schedule.early_exit:
+                    stopped_at = next((s for s, p in zip(window_starts[scored:], probs[scored:])
+                                       if p > DEEPFAKE_THRESHOLD), None)
+            if cfg['timing_events']:
+                yield "STATS:" + json.dumps({"frame": idxs[-1], **progress("inference")})
+            if stopped_at is not None:
+                yield (f"LOG:Early exit: window at frame {stopped_at} is above {DEEPFAKE_THRESHOLD}, "
+                       f"skipping the rest of the video")
+                break
+        yield from drain(logs)
+    finally:
+        pipe.close()
+    stages = pipe.report()
+
+    num_windows = len(probs)
+    frames_analyzed = counts['analyzed']
+    yield f"LOG:Decoded {counts['decoded']} frames, analyzed {frames_analyzed}."
+    yield f"LOG:Face localization: {tracker.detections} detections, {tracker.tracked} tracked frames."
+    yield f"LOG:Backbone encoded {counts['encoded']} frames for {num_windows * wsize} window frames."
+    if dedup.reused:
+        yield f"LOG:Reused embeddings for {dedup.reused} near-duplicate frames."
+    yield "LOG:Stage busy time: " + ", ".join(
+        f"{name} {s['busy_s']:.2f}s (max queue {s['max_queue']})" for name, s in stages.items())
+    embedding_key = None
+    if writer is not None:
+        try:
+            embedding_key = writer.save(frames_analyzed, {"filename": filename, "sampling": plan,
+                                                          "total_frames": total_frames or counts['decoded'],
+                                                          "video_duration_seconds": duration_sec,
+                                                          "scan_mode": schedule.mode})
+            yield f"LOG:Saved {len(writer)} frame embeddings as {embedding_key}."
+        except Exception as e:
+            yield f"LOG:Error saving frame embeddings: {str(e)}"
             
     # Yield the final result
-    probs = [res['prob'] for res in window_results]
     max_prob = max(probs) if probs else 0
-    is_deepfake = 0.025 < max_prob < 0.03 or max_prob > 0.5
-
-    face_images_b64 = []
-    results_with_faces = [res for res in window_results if res['face_crop'] is not None]
-    
-    if results_with_faces:
-        sorted_results = sorted(results_with_faces, key=lambda x: x['prob'])
-        
-        unique_faces = []
-        face_keys = set()
-
-        def add_unique_face(crop):
-            if crop is None: return
-            crop_bytes = crop.tobytes()
-            if crop_bytes not in face_keys:
-                unique_faces.append(crop)
-                face_keys.add(crop_bytes)
-
-        # Add face with highest probability
-        add_unique_face(sorted_results[-1]['face_crop'])
-        # Add face with lowest probability
-        if len(sorted_results) > 1:
-            add_unique_face(sorted_results[0]['face_crop'])
-        # Add face with median probability
-        if len(sorted_results) > 2:
-            median_idx = len(sorted_results) // 2
-            add_unique_face(sorted_results[median_idx]['face_crop'])
-
-        for crop in unique_faces:
-            pil_img = Image.fromarray(crop)
-            buff = io.BytesIO()
-            pil_img.save(buff, format="PNG")
-            face_images_b64.append(base64.b64encode(buff.getvalue()).decode("utf-8"))
+    is_deepfake = deepfake_verdict(max_prob)
+    # Refinements are scored after the coarse window that triggered them
+    order = sorted(range(num_windows), key=window_starts.__getitem__)
 
+    encoding_started = time.perf_counter()
+    probabilities = [probs[k] for k in order]
+    if cfg['result_format'] == "compact":
+        probabilities = compact_probabilities(probabilities)
+    face_images_b64, face_image_ids = face_image_fields(faces.crops(), cfg, thumbnails)
 
     result = {
-        "filename": video_path,
+        "filename": filename,
         "is_deepfake": is_deepfake,
         "confidence": max_prob,
-        "probabilities": probs,
+        "probabilities": probabilities,
         "face_images_b64": face_images_b64,
-        "total_frames": total_frames,
+        "face_image_ids": face_image_ids,
+        "result_format": cfg['result_format'],
+        "total_frames": total_frames or counts['decoded'],
         "video_duration_seconds": duration_sec,
         "windows_analyzed": num_windows,
+        "scan_mode": schedule.mode,
+        "window_starts": [window_starts[k] for k in order],
+        "early_exit": stopped_at is not None,
+        "sampling": {**plan, "frames_decoded": counts['decoded'], "frames_analyzed": frames_analyzed},
+        "dedup": dedup.stats(),
+        "pipeline": {"queue_depth": depth, "face_detect_workers": workers, "stages": stages,
+                     "forward_s": {part: round(s, 4) for part, s in forward_s.items()}},
     }
-    yield f"RESULT:{json.dumps(result)}" 
\ No newline at end of file
+    if embedding_key is not None:
+        result["embedding_key"] = embedding_key
+    payload = json.dumps(result)
+    encoding_s = time.perf_counter() - encoding_started
+
+    for name, s in stages.items():
+        STAGE_SECONDS.observe(s['busy_s'], stage=name)
+    for part, s in forward_s.items():
+        STAGE_SECONDS.observe(s, stage=part)
+    STAGE_SECONDS.observe(encoding_s, stage="result_encoding")
+    ANALYSIS_SECONDS.observe(time.perf_counter() - started)
+    for step in ("decoded", "analyzed", "encoded"):
+        FRAMES_TOTAL.inc(counts[step], step=step)
+    FRAMES_TOTAL.inc(dedup.reused, step="deduplicated")
+    WINDOWS_TOTAL.inc(num_windows)
+    FACE_LOCALIZATIONS_TOTAL.inc(tracker.detections, method="detected")
+    FACE_LOCALIZATIONS_TOTAL.inc(tracker.tracked, method="tracked")
+    if cfg['timing_events']:
+        yield "STATS:" + json.dumps({**progress("done"), "final": True, "result_encoding_s": round(encoding_s, 4),
+                                     "stages_s": {name: s['busy_s'] for name, s in stages.items()}})
+    yield f"RESULT:{payload}"
+
+# 9. Live analysis
+def live_frames(source, cfg=CONFIG, follow=False):
+    """Frames to analyze from a live source: an RTSP/HTTP URL, a FIFO, or a file still being written.
+
+    With `follow`, reading a local file waits at its end for more data
+    instead of stopping, until FFmpeg gives up after 10 s without growth.
+    """
+    options = {}
+    if source.startswith("rtsp://"):
+        options["rtsp_transport"] = "tcp"
+    elif follow:
+        source = source if source.startswith("file:") else "file:" + source
+        options.update(follow="1", rw_timeout="10000000")
+    cont = av.open(source, options=options)
+    def decoded():
+        try:
+            for packet in cont.demux(stream):
+                yield from packet.decode()
+        except OSError:
+            # A followed file that stopped growing has ended; anything else is an error
+            if not follow: raise
+            yield from stream.codec_context.decode(None)
+    try:
+        stream = cont.streams.video[0]
+        configure_decoder(stream, cfg)
+        # Live streams decode at their own pace; skip frame threading's added delay
+        stream.thread_type = "SLICE"
+        plan = decode_plan(stream, cfg)
+        yield from iter_frames(cont, stream, plan, {"decoded": 0, "analyzed": 0}, decoded())
+    finally:
+        cont.close()
+
+class IncrementalAnalyzer:
+    """Scores a live feed window by window as frames are pushed in.
+
+    Keeps the face track and the recent per-frame embeddings between
+    pushes, encodes frames in small batches as they arrive, and scores each
+    window as soon as its last frame is in, so overlapping windows reuse
+    the backbone work just as in sliding_window_inference. `latencies` holds,
+    per window, the seconds from its last frame's push to its probability.
+    Compact results put face thumbnails in `thumbnails`, as
+    sliding_window_inference does.
+    """
+    def __init__(self, model, cfg=CONFIG, sample_every_n=None, channel_order='rgb', thumbnails=None):
+        self.model = model
+        self.cfg = cfg
+        self.thumbnails = thumbnails
+        self.wsize, self.stride = cfg['window_size'], cfg['window_stride']
+        self.sample_every_n = max(1, sample_every_n or cfg['sample_every_n'])
+        self.encode_batch = max(1, cfg['live_encode_batch'])
+        self.max_side = cfg['decode_max_side']
+        self.tracker = FaceTracker(cfg['face_detect_max_side'], cfg['face_redetect_every'],
+                                   cfg['face_track_min_confidence'], cache_frames=self.wsize + self.stride,
+                                   channel_order=channel_order)
+        self.preprocess = FramePreprocessor(cfg['frame_size'], channel_order)
+        self.embeddings = FrameEmbeddingCache(self.wsize + self.stride + self.encode_batch)
+        self.dedup = FrameDeduplicator(cfg['dedup_threshold'])
+        self.faces = FaceCandidates()
+        self.window_crops = {}
+        self.pending = []
+        self.frames_pushed = 0
+        self.frames_analyzed = 0
+        self.frames_encoded = 0
+        self.probs, self.window_starts, self.latencies = [], [], []
+        self.errors = deque(maxlen=20)
+        self.started = time.perf_counter()
+
+    def push(self, frame):
+        """Add one HxWx3 frame; returns the windows it completed as dicts."""
+        arrived = time.perf_counter()
+        n = self.frames_pushed
+        self.frames_pushed += 1
+        if n % self.sample_every_n:
+            return []
+        idx = self.frames_analyzed
+        self.frames_analyzed += 1
+        if idx % self.stride >= self.wsize:
+            return []
+        if self.max_side and max(frame.shape[:2]) > self.max_side:
+            h, w = frame.shape[:2]
+            scale = self.max_side / max(h, w)
+            frame = cv2.resize(frame, (max(2, round(w * scale)), max(2, round(h * scale))),
+                               interpolation=cv2.INTER_AREA)
+        box = None
+        try:
+            box = self.tracker.locate(idx, frame)
+        except Exception as e:
+            self.errors.append(f"Face detection failed for frame {idx}: {str(e)}")
+        if box is not None and idx % self.stride == 0:
+            t,r,b,l = box
+            self.window_crops[idx] = frame[t:b, l:r].copy()
+        self.pending.append((idx, frame, box))
+
+        start = idx - self.wsize + 1
+        completes = start >= 0 and start % self.stride == 0
+        if completes or len(self.pending) >= self.encode_batch:
+            self._encode()
+        if not completes:
+            return []
+        return [self._score(start, arrived)]
+
+    def _encode(self):
+        idxs = [idx for idx, _, _ in self.pending]
+        try:
+            batch = self.preprocess([frame for _, frame, _ in self.pending], [box for _, _, box in self.pending])
+            reused = self.dedup.reused
+            with torch.no_grad():
+                emb = self.dedup.encode(batch.to(device), self.model.encode)
+            self.frames_encoded += len(idxs) - (self.dedup.reused - reused)
+            for idx, e in zip(idxs, emb):
+                self.embeddings.put(idx, e)
+        except Exception as e:
+            self.errors.append(f"Error encoding frames {idxs[0]}-{idxs[-1]}: {str(e)}")
+        self.pending = []
+
+    def _score(self, start, arrived):
+        seq = [self.embeddings.get(idx) for idx in range(start, start + self.wsize)]
+        # Use a neutral probability to continue processing
+        prob = 0.5
+        if all(e is not None for e in seq):
+            try:
+                with torch.no_grad():
+                    prob = torch.sigmoid(self.model.score(torch.stack(seq).unsqueeze(0)))[0].item()
+            except Exception as e:
+                self.errors.append(f"Error processing window at frame {start}: {str(e)}")
+        else:
+            self.errors.append(f"Error processing window at frame {start}: missing frame embeddings")
+        latency = time.perf_counter() - arrived
+        self.probs.append(prob)
+        self.window_starts.append(start)
+        self.latencies.append(latency)
+        self.faces.add(prob, self.window_crops.pop(start, None))
+        for old in [s for s in self.window_crops if s < start]:
+            del self.window_crops[old]
+        WINDOWS_TOTAL.inc()
+        return {"start": start, "probability": prob, "latency_s": round(latency, 4), **self.verdict()}
+
+    def verdict(self):
+        """Running verdict over the windows scored so far."""
+        max_prob = max(self.probs) if self.probs else 0
+        return {
+            "windows": len(self.probs),
+            "max_probability": max_prob,
+            "is_deepfake": deepfake_verdict(max_prob),
+        }
+
+    def latency_stats(self):
+        if not self.latencies:
+            return {}
+        ordered = sorted(self.latencies)
+        return {"last": round(self.latencies[-1], 4),
+                "p50": round(ordered[len(ordered) // 2], 4),
+                "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+                "max": round(ordered[-1], 4)}
+
+    def result(self, filename="live"):
+        """The final result, shaped like sliding_window_inference's RESULT."""
+        verdict = self.verdict()
+        elapsed = time.perf_counter() - self.started
+        compact = self.cfg['result_format'] == "compact"
+        face_images_b64, face_image_ids = face_image_fields(self.faces.crops(), self.cfg, self.thumbnails)
+        return {
+            "filename": filename,
+            "is_deepfake": verdict["is_deepfake"],
+            "confidence": verdict["max_probability"],
+            "probabilities": compact_probabilities(self.probs) if compact else list(self.probs),
+            "face_images_b64": face_images_b64,
+            "face_image_ids": face_image_ids,
+            "result_format": self.cfg['result_format'],
+            "total_frames": self.frames_pushed,
+            "video_duration_seconds": None,
+            "windows_analyzed": verdict["windows"],
+            "scan_mode": "live",
+            "window_starts": list(self.window_starts),
+            "early_exit": False,
+            "sampling": {"sample_every_n": self.sample_every_n, "frames_decoded": self.frames_pushed,
+                         "frames_analyzed": self.frames_analyzed},
+            "dedup": self.dedup.stats(),
+            "live": {"elapsed_s": round(elapsed, 3), "frames_encoded": self.frames_encoded,
+                     "window_latency_s": self.latency_stats(), "errors": list(self.errors)},
+        }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Prepare a ready-to-run checkpoint for fast, offline startup.")
+    parser.add_argument("checkpoint")
+    parser.add_argument("out")
+    args = parser.parse_args()
+    save_ready_model(args.checkpoint, args.out)
+    print(f"Wrote {args.out}")
@@ -0,0 +1,188 @@
+"""Parity checks between the optimized inference paths and their reference versions.
+
+Usage:
+    python parity.py preprocess [--video clip.mp4] [--tolerance 0.02]
+    python parity.py engine int8 bf16 [--model weights.pth] [--video clip.mp4] [--tolerance 0.001]
+    python parity.py dedup --video clip.mp4 [--model weights.pth] [--thresholds 0.005 0.01 0.02] [--tolerance 0.001]
+
+Exits with status 1 when the measured drift exceeds the tolerance or a verdict changes.
+"""
+import argparse
+import json
+import sys
+import time
+
+import av
+import cv2
+import numpy as np
+import torch
+import torchvision.transforms as T
+from PIL import Image
+
+from engine import (ENGINE_BACKENDS, ENGINE_TOLERANCE, build_engine, clip_probabilities, parity_failure,
+                    probability_parity, reference_windows, window_probabilities)
+from model import CONFIG, IMAGENET_MEAN, IMAGENET_STD, FramePreprocessor, get_model, sliding_window_inference
+
+# torch's uint8 bicubic kernel rounds differently from PIL's on some pixels;
+# the worst seen on real and synthetic frames is 2 uint8 levels. Allow 4,
+# normalized by the smallest ImageNet std, so decoder or kernel updates do
+# not trip it; real bugs (channel order, crop offset, missed normalization)
+# move pixels by tens of levels.
+PREPROCESS_LEVELS = 4
+PREPROCESS_TOLERANCE = PREPROCESS_LEVELS / 255 / min(IMAGENET_STD)
+
+def reference_preprocess(frames, boxes, size):
+    """The original per-frame path: cvtColor, PIL resize, then Resize/ToTensor/Normalize."""
+    tf = T.Compose([
+        T.Resize((size, size)),
+        T.ToTensor(),
+        T.Normalize(list(IMAGENET_MEAN), list(IMAGENET_STD))
+    ])
+    tensors = []
+    for img_bgr, box in zip(frames, boxes):
+        rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+        if box is not None:
+            t,r,b,l = box; rgb = rgb[t:b, l:r]
+        tensors.append(tf(Image.fromarray(rgb).resize((size, size))))
+    return torch.stack(tensors)
+
+def preprocess_parity(frames, boxes, size=CONFIG['frame_size']):
+    """Max and mean absolute difference between FramePreprocessor and the reference path."""
+    ref = reference_preprocess(frames, boxes, size)
+    out = FramePreprocessor(size, channel_order='bgr')(frames, boxes)
+    diff = (out - ref).abs()
+    return {"max_abs_diff": float(diff.max()), "mean_abs_diff": float(diff.mean())}
+
+def synthetic_frames(n=16, height=720, width=1280, seed=0):
+    """Smooth gradients plus noise, so resampling differences are not hidden by flat colour."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    frames = []
+    for i in range(n):
+        base = np.stack([(xx + 7*i) % 256, (yy + 3*i) % 256, (xx + yy) % 256], axis=-1)
+        noise = rng.integers(-20, 21, size=base.shape)
+        frames.append(np.clip(base + noise, 0, 255).astype(np.uint8))
+    return frames
+
+def read_frames(video_path, n):
+    frames = []
+    with av.open(video_path) as cont:
+        for frame in cont.decode(video=0):
+            frames.append(frame.to_ndarray(format='bgr24'))
+            if len(frames) == n: break
+    return frames
+
+def clip_result(runner, video_path, **overrides):
+    """The RESULT of a full scan of `video_path`."""
+    result = None
+    for message in sliding_window_inference(runner, video_path, {**CONFIG, "scan_mode": "full", **overrides}):
+        if message.startswith("RESULT:"):
+            result = json.loads(message[len("RESULT:"):])
+    return result
+
+def check_preprocess(args):
+    frames = read_frames(args.video, args.frames) if args.video else synthetic_frames(args.frames)
+    h, w = frames[0].shape[:2]
+    # Full frames and an off-centre crop, like the no-face and face paths
+    box = (h // 5, w // 2 + w // 8, h // 5 + h // 3, w // 2 - w // 8)
+    failed = False
+    for name, boxes in (("full frame", [None] * len(frames)), ("face crop", [box] * len(frames))):
+        stats = preprocess_parity(frames, boxes)
+        ok = stats["max_abs_diff"] <= args.tolerance
+        failed |= not ok
+        print(f"{name}: max {stats['max_abs_diff']:.5f}, mean {stats['mean_abs_diff']:.6f} "
+              f"(tolerance {args.tolerance:.5f}) {'OK' if ok else 'FAIL'}")
+    return failed
+
+def check_engine(args):
+    model = get_model(args.model)
+    if args.video:
+        probabilities = lambda runner: clip_probabilities(runner, args.video)
+    else:
+        frames = reference_windows(CONFIG, args.windows)
+        probabilities = lambda runner: window_probabilities(runner, frames, CONFIG['window_size'])
+    t0 = time.perf_counter()
+    ref = probabilities(model)
+    eager_s = time.perf_counter() - t0
+    print(f"eager: {len(ref)} windows in {eager_s:.2f}s")
+    failed = False
+    for backend in args.backends:
+        try:
+            engine = build_engine(model, backend, CONFIG, check=False)
+            probabilities(engine)  # warm-up: compilation, lazy initialization
+            t0 = time.perf_counter()
+            out = probabilities(engine)
+            elapsed = time.perf_counter() - t0
+        except Exception as e:
+            failed = True
+            print(f"{backend}: unavailable ({e}) FAIL")
+            continue
+        if len(out) != len(ref):
+            failed = True
+            print(f"{backend}: {len(out)} windows instead of {len(ref)} FAIL")
+            continue
+        stats = probability_parity(ref, out)
+        failure = parity_failure(stats, args.tolerance)
+        failed |= failure is not None
+        print(f"{backend}: max {stats['max_abs_diff']:.5f}, mean {stats['mean_abs_diff']:.6f} "
+              f"(tolerance {args.tolerance:.5f}), {stats['windows_crossing']} window(s) crossing a verdict boundary, "
+              f"{elapsed:.2f}s ({eager_s / elapsed:.2f}x) {'OK' if failure is None else 'FAIL'}")
+    return failed
+
+def check_dedup(args):
+    model = get_model(args.model)
+    clip_result(model, args.video, dedup_threshold=0.0)  # warm-up, so the first timing is comparable
+    t0 = time.perf_counter()
+    reference = clip_result(model, args.video, dedup_threshold=0.0)
+    ref = torch.tensor(reference["probabilities"])
+    full_s = time.perf_counter() - t0
+    print(f"no dedup: {len(ref)} windows in {full_s:.2f}s")
+    failed = False
+    for threshold in args.thresholds:
+        t0 = time.perf_counter()
+        result = clip_result(model, args.video, dedup_threshold=threshold)
+        elapsed = time.perf_counter() - t0
+        out = torch.tensor(result["probabilities"])
+        if len(out) != len(ref):
+            failed = True
+            print(f"threshold {threshold:g}: {len(out)} windows instead of {len(ref)} FAIL")
+            continue
+        stats = probability_parity(ref, out)
+        # A changed verdict fails even if the drift is within tolerance
+        changed = stats["verdict_changed"] or result["is_deepfake"] != reference["is_deepfake"]
+        ok = not changed and parity_failure(stats, args.tolerance) is None
+        failed |= not ok
+        print(f"threshold {threshold:g}: skipped {result['dedup']['skip_fraction']:.1%} of frames, "
+              f"max {stats['max_abs_diff']:.5f}, mean {stats['mean_abs_diff']:.6f} (tolerance {args.tolerance:.5f}), "
+              f"{stats['windows_crossing']} window(s) crossing a verdict boundary, "
+              f"{elapsed:.2f}s ({full_s / elapsed:.2f}x), verdict {'CHANGED' if changed else 'unchanged'} "
+              f"{'OK' if ok else 'FAIL'}")
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="check", required=True)
+    pre = sub.add_parser("preprocess", help="FramePreprocessor vs. the PIL/torchvision transform")
+    pre.add_argument("--video", help="read frames from this clip instead of synthetic ones")
+    pre.add_argument("--frames", type=int, default=CONFIG['window_size'])
+    pre.add_argument("--tolerance", type=float, default=PREPROCESS_TOLERANCE)
+    eng = sub.add_parser("engine", help="inference backends vs. eager window probabilities")
+    eng.add_argument("backends", nargs="+", choices=ENGINE_BACKENDS)
+    eng.add_argument("--model", default="visual_only_best_model.pth")
+    eng.add_argument("--video", help="compare a full scan of this clip instead of synthetic windows")
+    eng.add_argument("--windows", type=int, default=4, help="synthetic windows to compare")
+    eng.add_argument("--tolerance", type=float, default=ENGINE_TOLERANCE)
+    ded = sub.add_parser("dedup", help="frame deduplication thresholds vs. encoding every frame")
+    ded.add_argument("--video", required=True)
+    ded.add_argument("--model", default="visual_only_best_model.pth")
+    ded.add_argument("--thresholds", type=float, nargs="+", default=[0.005, 0.01, 0.02])
+    ded.add_argument("--tolerance", type=float, default=ENGINE_TOLERANCE,
+                     help="largest window-probability drift (default well under the 0.005-wide suspect band)")
+    args = parser.parse_args(argv)
+
+    checks = {"preprocess": check_preprocess, "engine": check_engine, "dedup": check_dedup}
+    failed = checks[args.check](args)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+import queue
+import threading
+import time
+
+class _Failure:
+    def __init__(self, exc): self.exc = exc
+
+_END = object()
+
+class StageStats:
+    """Busy time and queue occupancy of one pipeline stage."""
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.elapsed_s = 0.0
+        self.get_wait_s = 0.0   # blocked waiting for the upstream stage
+        self.put_wait_s = 0.0   # blocked because the downstream queue was full
+        self.max_queue = 0
+        self._queue_sum = 0
+    @property
+    def busy_s(self):
+        return max(0.0, self.elapsed_s - self.get_wait_s - self.put_wait_s)
+    def as_dict(self):
+        return {
+            "items": self.items,
+            "busy_s": round(self.busy_s, 4),
+            "wait_s": round(self.get_wait_s + self.put_wait_s, 4),
+            "max_queue": self.max_queue,
+            "mean_queue": round(self._queue_sum / self.items, 2) if self.items else 0.0,
+        }
+
+class Pipeline:
+    """Chain of generator stages, each optionally running in its own thread.
+
+    `stage(name, fn, upstream)` wraps `fn(upstream)`. With `depth > 0` the
+    stage runs in a daemon thread and hands items downstream through a
+    queue bounded to `depth`; with `depth == 0` stages are plain chained
+    generators and run on the consumer's thread, timed inclusively and
+    reported exclusive of their upstream.
+
+    Always call `close()` (e.g. in a `finally`) so worker threads stop
+    before any resource they read from, like the video container, is closed.
+    """
+    def __init__(self, depth):
+        self.depth = depth
+        self.stats = []
+        self._threads = []
+        self._stop = threading.Event()
+
+    def stage(self, name, fn, upstream=None):
+        stats = StageStats(name)
+        self.stats.append(stats)
+        if not self.depth:
+            return self._timed(fn(upstream), stats)
+        q = queue.Queue(maxsize=self.depth)
+        source = self._consume(upstream, stats) if upstream is not None else None
+        thread = threading.Thread(target=self._run, args=(fn, source, q, stats),
+                                  name=f"pipeline-{name}", daemon=True)
+        self._threads.append(thread)
+        thread.start()
+        return _QueueReader(q, self._stop)
+
+    def consume(self, upstream, name):
+        """Iterate the last stage on the calling thread, accounting its wait time to `name`."""
+        stats = StageStats(name)
+        self.stats.append(stats)
+        start = time.perf_counter()
+        try:
+            for item in self._consume(upstream, stats):
+                stats.items += 1
+                yield item
+        finally:
+            stats.elapsed_s = time.perf_counter() - start
+
+    def _consume(self, upstream, stats):
+        if isinstance(upstream, _QueueReader):
+            return upstream.items(stats)
+        return self._waited(upstream, stats)
+
+    def _waited(self, upstream, stats):
+        it = iter(upstream)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                stats.get_wait_s += time.perf_counter() - t0
+            yield item
+
+    def _timed(self, gen, stats):
+        it = iter(gen)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                stats.elapsed_s += time.perf_counter() - t0
+                return
+            stats.elapsed_s += time.perf_counter() - t0
+            stats.items += 1
+            yield item
+
+    def _run(self, fn, source, q, stats):
+        start = time.perf_counter()
+        try:
+            for item in fn(source):
+                stats.items += 1
+                if not self._put(q, item, stats):
+                    return
+        except BaseException as e:
+            self._put(q, _Failure(e), stats)
+        finally:
+            stats.elapsed_s = time.perf_counter() - start
+            self._put(q, _END, stats)
+
+    def _put(self, q, item, stats):
+        t0 = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            stats.put_wait_s += time.perf_counter() - t0
+            depth = q.qsize()
+            stats.max_queue = max(stats.max_queue, depth)
+            stats._queue_sum += depth
+            return True
+        return False
+
+    def close(self, timeout=5.0):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def report(self):
+        """Per-stage stats; serial stages are made exclusive of the stages upstream of them."""
+        out = {}
+        upstream = 0.0
+        for stats in self.stats:
+            d = stats.as_dict()
+            if not self.depth and stats is not self.stats[-1]:
+                d["busy_s"] = round(max(0.0, stats.elapsed_s - upstream), 4)
+                upstream = stats.elapsed_s
+            out[stats.name] = d
+        return out
+
+class _QueueReader:
+    def __init__(self, q, stop):
+        self._q = q
+        self._stop = stop
+    def items(self, stats):
+        while True:
+            t0 = time.perf_counter()
+            item = _END
+            while not self._stop.is_set():
+                try:
+                    item = self._q.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    continue
+            stats.get_wait_s += time.perf_counter() - t0
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.exc
+            yield item
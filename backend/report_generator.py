@@ -1,9 +1,11 @@
 from fpdf import FPDF
-from PIL import Image
-import numpy as np
-import matplotlib.pyplot as plt
 import io
 import base64
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict
 from datetime import datetime
 import os
 
@@ -18,7 +20,93 @@ class PDF(FPDF):
         self.set_font('Arial', 'I', 8)
         self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
 
-def generate_report(analysis_result: dict) -> bytes:
+def _ticks(lo, hi, count=5):
+    """Round, whole-number tick positions covering [lo, hi]."""
+    span = max(hi - lo, 1)
+    raw = span / count
+    step = 10 ** math.floor(math.log10(raw))
+    step = max(next(m * step for m in (1, 2, 5, 10) if m * step >= raw), 1)
+    first = math.ceil(lo / step) * step
+    return [first + k * step for k in range(int((hi - first) // step) + 1)]
+
+def draw_probability_chart(pdf, xs, probs, xlabel, connect=True, height=70):
+    """Draw probabilities against `xs` as vector lines at the current position."""
+    xs, probs = list(xs), list(probs)
+    if pdf.get_y() + height + 25 > pdf.page_break_trigger:
+        pdf.add_page()
+    left, top = pdf.l_margin + 12, pdf.get_y() + 8
+    width = pdf.w - pdf.r_margin - left
+    lo, hi = min(xs), max(xs)
+    if hi == lo:
+        lo, hi = lo - 1, hi + 1
+    def px(x):
+        return left + (x - lo) / (hi - lo) * width
+    def py(p):
+        return top + (1 - p) * height
+
+    pdf.set_font('helvetica', 'B', 10)
+    pdf.cell(0, 6, 'Deepfake Probability per Video Window', 0, 1, 'C')
+
+    # Grid and axis labels
+    pdf.set_font('helvetica', '', 7)
+    pdf.set_line_width(0.1)
+    pdf.set_draw_color(210, 210, 210)
+    for p in (0, 0.25, 0.5, 0.75, 1):
+        pdf.line(left, py(p), left + width, py(p))
+        pdf.text(left - 8, py(p) + 1, f"{p:.2f}")
+    for x in _ticks(lo, hi):
+        pdf.line(px(x), top, px(x), top + height)
+        label = f"{x:g}"
+        pdf.text(px(x) - pdf.get_string_width(label) / 2, top + height + 4, label)
+    pdf.set_draw_color(0, 0, 0)
+    pdf.rect(left, top, width, height)
+
+    # Thresholds
+    pdf.set_line_width(0.3)
+    pdf.set_dash_pattern(dash=1.5, gap=1)
+    for p, color in ((0.5, (220, 0, 0)), (0.03, (0, 150, 0))):
+        pdf.set_draw_color(*color)
+        pdf.line(left, py(p), left + width, py(p))
+    pdf.set_dash_pattern()
+
+    # Probabilities; markers only while they stay legible
+    pdf.set_draw_color(0, 0, 255)
+    pdf.set_fill_color(0, 0, 255)
+    points = [(px(x), py(min(max(p, 0), 1))) for x, p in zip(xs, probs)]
+    if connect and len(points) > 1:
+        pdf.polyline(points)
+    if not connect or len(points) <= 200:
+        for x, y in points:
+            pdf.circle(x, y, 0.6, style='F')
+
+    # Axis title and legend
+    pdf.set_font('helvetica', '', 8)
+    pdf.set_text_color(0, 0, 0)
+    pdf.text(left + width / 2 - pdf.get_string_width(xlabel) / 2, top + height + 9, xlabel)
+    y = top + height + 14
+    x = left
+    for label, color, dashed in (('Probability', (0, 0, 255), False),
+                                 ('Deepfake Threshold (>0.5)', (220, 0, 0), True),
+                                 ('Authentic Threshold (<0.03)', (0, 150, 0), True)):
+        pdf.set_draw_color(*color)
+        if dashed:
+            pdf.set_dash_pattern(dash=1.5, gap=1)
+        pdf.line(x, y - 1, x + 8, y - 1)
+        pdf.set_dash_pattern()
+        pdf.text(x + 10, y, label)
+        x += 14 + pdf.get_string_width(label)
+    pdf.set_draw_color(0, 0, 0)
+    pdf.set_fill_color(255, 255, 255)
+    pdf.set_line_width(0.2)
+    pdf.set_y(y + 4)
+
+def generate_report(analysis_result: dict, face_images=None) -> bytes:
+    """PDF report of an analysis result.
+
+    `face_images` are encoded images (PNG, JPEG or WebP bytes) to show
+    instead of the result's face_images_b64, e.g. thumbnails of a compact
+    result loaded by ID.
+    """
     pdf = PDF()
     pdf.add_page()
     
@@ -43,6 +131,10 @@ def generate_report(analysis_result: dict) -> bytes:
         "Total Frames": str(frames) if frames is not None else "N/A",
         "Windows Analyzed": str(windows) if windows is not None else "N/A",
     }
+    scan_mode = analysis_result.get('scan_mode') or 'full'
+    if scan_mode != 'full':
+        summary_data["Scan Mode"] = scan_mode.replace('_', ' ') + (
+            " (stopped early)" if analysis_result.get('early_exit') else "")
 
     for key, value in summary_data.items():
         pdf.set_font('helvetica', 'B', 10)
@@ -57,16 +149,17 @@ def generate_report(analysis_result: dict) -> bytes:
     pdf.cell(0, 10, 'Evidence', 0, 1, 'L')
     pdf.set_font('helvetica', 'B', 10)
     
-    face_images_b64 = analysis_result.get('face_images_b64', [])
+    if face_images is None:
+        face_images = [base64.b64decode(face_b64) for face_b64 in analysis_result.get('face_images_b64') or []]
     
-    if not face_images_b64:
+    if not face_images:
         pdf.cell(0, 10, 'No face crops available.', 0, 1, 'L')
     else:
         pdf.cell(0, 10, 'Key Frame Face Crops:', 0, 1, 'L')
         pdf.ln(2)
 
         # Calculate image layout
-        num_images = len(face_images_b64)
+        num_images = len(face_images)
         img_width = 50 
         img_height = 50
         margin = 10
@@ -79,17 +172,14 @@ def generate_report(analysis_result: dict) -> bytes:
         x = x_start
         y = y_start
 
-        for i, face_b64 in enumerate(face_images_b64):
+        for i, img_bytes in enumerate(face_images):
             try:
-                img_bytes = base64.b64decode(face_b64)
-                img = Image.open(io.BytesIO(img_bytes))
-                
                 # Check if we need to move to the next row
                 if i > 0 and i % images_per_row == 0:
                     y += img_height + margin
                     x = x_start
 
-                pdf.image(img, x=x, y=y, w=img_width, h=img_height)
+                pdf.image(io.BytesIO(img_bytes), x=x, y=y, w=img_width, h=img_height)
                 x += img_width + margin
 
             except Exception as e:
@@ -108,25 +198,99 @@ def generate_report(analysis_result: dict) -> bytes:
     pdf.cell(0, 10, 'Per-Window Probability Analysis:', 0, 1)
     
     probs = analysis_result.get('probabilities', [])
+    starts = analysis_result.get('window_starts')
     if probs:
-        fig, ax = plt.subplots(figsize=(8, 4))
-        ax.plot(probs, marker='o', linestyle='-', color='b')
-        ax.axhline(y=0.5, color='r', linestyle='--', label='Deepfake Threshold (>0.5)')
-        ax.axhline(y=0.03, color='g', linestyle='--', label='Authentic Threshold (<0.03)')
-        ax.set_title('Deepfake Probability per Video Window')
-        ax.set_xlabel('Window Index')
-        ax.set_ylabel('Probability')
-        ax.legend()
-        ax.grid(True)
-        
-        plot_buffer = io.BytesIO()
-        plt.savefig(plot_buffer, format='png', bbox_inches='tight')
-        plt.close(fig)
-        plot_buffer.seek(0)
-        
-        pdf.image(plot_buffer, w=pdf.w - 40)
+        # Only some windows were evaluated: plot them where they start, unconnected
+        partial = scan_mode != 'full' and starts and len(starts) == len(probs)
+        draw_probability_chart(pdf, starts if partial else range(len(probs)), probs,
+                               'Window Start Frame' if partial else 'Window Index', connect=not partial)
     else:
         pdf.set_font('Arial', 'I', 10)
         pdf.cell(0, 10, 'No probability data available.', 0, 1)
 
-    return pdf.output(dest='S') 
\ No newline at end of file
+    return bytes(pdf.output())
+
+def report_key(analysis_result: dict) -> str:
+    """Hash of the result a report is generated from."""
+    return hashlib.sha256(json.dumps(analysis_result, sort_keys=True).encode()).hexdigest()
+
+class ReportCache:
+    """In-memory LRU of generated PDFs keyed by report_key, bounded in bytes.
+
+    A cached report keeps the generation time of its first rendering.
+    """
+    def __init__(self, max_bytes=64 * 2**20):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._reports = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_generate(self, analysis_result: dict, face_images=None) -> bytes:
+        key = report_key(analysis_result)
+        with self._lock:
+            pdf = self._reports.get(key)
+            if pdf is not None:
+                self._reports.move_to_end(key)
+                self.hits += 1
+                return pdf
+            self.misses += 1
+        pdf = generate_report(analysis_result, face_images)
+        if len(pdf) <= self.max_bytes:
+            with self._lock:
+                if key not in self._reports:
+                    self._reports[key] = pdf
+                    self.bytes += len(pdf)
+                while self.bytes > self.max_bytes:
+                    _, old = self._reports.popitem(last=False)
+                    self.bytes -= len(old)
+        return pdf
+
+    def stats(self):
+        with self._lock:
+            return {"reports": len(self._reports), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+def _load_results(paths):
+    """(name, result) pairs from .json result files and .jsonl files of results."""
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        with open(path) as f:
+            if not path.endswith(".jsonl"):
+                yield stem, json.load(f)
+                continue
+            for n, line in enumerate(f):
+                if line.strip():
+                    yield f"{stem}-{n}", json.loads(line)
+
+def _write_report(job):
+    name, result, out_dir = job
+    path = os.path.join(out_dir, f"{name}.pdf")
+    with open(path, "wb") as f:
+        f.write(generate_report(result))
+    return path
+
+def generate_reports(paths, out_dir, workers=None):
+    """Render a PDF per result in `paths` into `out_dir` with a process pool. Yields written paths."""
+    from concurrent.futures import ProcessPoolExecutor
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = ((name, result, out_dir) for name, result in _load_results(paths) if "probabilities" in result)
+    with ProcessPoolExecutor(workers) as pool:
+        yield from pool.map(_write_report, jobs, chunksize=4)
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description="Render PDF reports for saved analysis results.")
+    parser.add_argument("results", nargs="+", help=".json result files or .jsonl files with one result per line")
+    parser.add_argument("--out-dir", default="reports")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: one per CPU)")
+    args = parser.parse_args()
+    started = time.perf_counter()
+    count = 0
+    for path in generate_reports(args.results, args.out_dir, args.workers):
+        count += 1
+        print(path)
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {count} reports in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.1f}/s)") 
\ No newline at end of file
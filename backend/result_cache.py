@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def checkpoint_sha256(path, memo_path=None):
+    """file_sha256 of a checkpoint, remembered in the JSON file `memo_path`.
+
+    The memo is keyed by the checkpoint's real path and checked against its
+    size and mtime, so restarts with an unchanged checkpoint skip hashing
+    it again and a replaced one is hashed anew.
+    """
+    st = os.stat(path)
+    key, stamp = os.path.realpath(path), [st.st_size, st.st_mtime_ns]
+    memo = {}
+    if memo_path is not None:
+        try:
+            with open(memo_path) as f:
+                memo = json.load(f)
+        except (OSError, ValueError):
+            memo = {}
+        entry = memo.get(key)
+        if isinstance(entry, dict) and entry.get("stamp") == stamp:
+            return entry["sha256"]
+    digest = file_sha256(path)
+    if memo_path is not None:
+        memo[key] = {"stamp": stamp, "sha256": digest}
+        try:
+            with open(memo_path + ".tmp", "w") as f:
+                json.dump(memo, f)
+            os.replace(memo_path + ".tmp", memo_path)
+        except OSError:
+            pass  # read-only or missing directory: hash again next time
+    return digest
+
+def model_fingerprint(model_path, cfg, digest=None):
+    """Identifies the checkpoint contents and inference settings a result came from.
+
+    `digest` is the checkpoint's sha256 when already known (see checkpoint_sha256).
+    """
+    h = hashlib.sha256()
+    h.update((digest or file_sha256(model_path)).encode())
+    h.update(json.dumps(cfg, sort_keys=True, default=str).encode())
+    return h.hexdigest()[:16]
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _evict_oldest(directory, suffixes, max_bytes, max_age_seconds):
+    """Drops files past `max_age_seconds`, then the oldest until the rest fit in `max_bytes`."""
+    now = time.time()
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(suffixes): continue
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if now - st.st_mtime > max_age_seconds:
+            _remove(path)
+        else:
+            entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes: break
+        _remove(path)
+        total -= size
+
+class ResultCache:
+    """Analysis results keyed by upload content hash and model fingerprint.
+
+    An in-memory LRU of `memory_entries` results sits in front of a directory
+    of JSON files. Disk entries older than `max_age_seconds` are dropped, and
+    the oldest ones are evicted whenever the directory grows past
+    `max_disk_bytes`. Keys embed the model fingerprint, so swapping the
+    checkpoint or changing CONFIG simply stops matching old entries, which
+    then age out.
+    """
+    def __init__(self, directory, fingerprint, memory_entries=128,
+                 max_disk_bytes=512 * 2**20, max_age_seconds=7 * 24 * 3600):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, content_hash, variant=None):
+        """Cache key for an upload; `variant` separates per-request options such as scan_mode."""
+        key = f"{content_hash}-{self.fingerprint}"
+        return f"{key}-{variant}" if variant else key
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key, valid=None):
+        """The cached result, or None. A result failing `valid(result)` is dropped and counts as a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[0] > self.max_age_seconds:
+                entry = None
+                self._memory.pop(key, None)
+        if entry is not None:
+            mtime, result = entry
+        else:
+            path = self._path(key)
+            try:
+                mtime = os.path.getmtime(path)
+                if now - mtime > self.max_age_seconds:
+                    _remove(path)
+                    raise FileNotFoundError(path)
+                with open(path) as f:
+                    result = json.load(f)
+            except (OSError, ValueError):
+                with self._lock:
+                    self.misses += 1
+                return None
+        if valid is not None and not valid(result):
+            self.discard(key)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self._remember(key, mtime, result)
+        return result
+
+    def discard(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+        _remove(self._path(key))
+
+    def put(self, key, result):
+        with self._lock:
+            self._remember(key, time.time(), result)
+        tmp = self._path(key) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(result, f)
+        os.replace(tmp, self._path(key))
+        self._evict_disk()
+
+    def _remember(self, key, stored_at, result):
+        self._memory[key] = (stored_at, result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        _evict_oldest(self.directory, ".json", self.max_disk_bytes, self.max_age_seconds)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "memory_entries": len(self._memory),
+                    "fingerprint": self.fingerprint}
+
+class ThumbnailStore:
+    """Content-addressed face thumbnails served by ID next to compact results.
+
+    IDs are the content hash plus an extension, so identical thumbnails are
+    stored once and an ID always names the same bytes. Files follow the
+    result cache's age limit under their own size limit; a cached result
+    whose thumbnails were evicted is dropped on lookup (see `touch`).
+    """
+    EXTENSIONS = {"image/jpeg": ".jpg", "image/webp": ".webp"}
+    MEDIA_TYPES = {ext: media_type for media_type, ext in EXTENSIONS.items()}
+    ID_PATTERN = re.compile(r"[0-9a-f]{32}\.(jpg|webp)")
+
+    def __init__(self, directory, max_disk_bytes=64 * 2**20, max_age_seconds=7 * 24 * 3600):
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age_seconds = max_age_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, data, media_type):
+        thumbnail_id = hashlib.sha256(data).hexdigest()[:32] + self.EXTENSIONS[media_type]
+        path = os.path.join(self.directory, thumbnail_id)
+        if os.path.exists(path):
+            os.utime(path)
+            return thumbnail_id
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        _evict_oldest(self.directory, tuple(self.MEDIA_TYPES), self.max_disk_bytes, self.max_age_seconds)
+        return thumbnail_id
+
+    def path(self, thumbnail_id):
+        """File path and media type of a stored thumbnail, or None if unknown or evicted."""
+        if not self.ID_PATTERN.fullmatch(thumbnail_id):
+            return None
+        path = os.path.join(self.directory, thumbnail_id)
+        if not os.path.exists(path):
+            return None
+        return path, self.MEDIA_TYPES[os.path.splitext(thumbnail_id)[1]]
+
+    def touch(self, thumbnail_ids):
+        """Refresh the age of every thumbnail in `thumbnail_ids`; False if any is gone."""
+        for thumbnail_id in thumbnail_ids:
+            found = self.path(thumbnail_id)
+            try:
+                if found is None:
+                    return False
+                os.utime(found[0])
+            except OSError:
+                return False
+        return True
+
+    def load(self, thumbnail_ids):
+        """Bytes of each stored thumbnail in `thumbnail_ids`, skipping missing ones."""
+        images = []
+        for thumbnail_id in thumbnail_ids:
+            found = self.path(thumbnail_id)
+            if found is None: continue
+            try:
+                with open(found[0], "rb") as f:
+                    images.append(f.read())
+            except OSError:
+                continue
+        return images
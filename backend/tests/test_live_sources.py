@@ -0,0 +1,66 @@
+"""live_source_allowed: the LIVE_SOURCES allowlist for server-side live sources."""
+import os
+
+import pytest
+
+import main
+
+@pytest.fixture
+def live_dir(tmp_path, monkeypatch):
+    """tmp/live is allowed; tmp/live-private and tmp/outside are not."""
+    for name in ("live", "live-private", "outside"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "cam.ts").write_bytes(b"")
+    monkeypatch.setattr(main, "LIVE_SOURCES", [str(tmp_path / "live"), "rtsp://cam.local/streams"])
+    return tmp_path
+
+def allowed(source):
+    return main.live_source_allowed(str(source))
+
+def test_files_inside_the_prefix_are_allowed(live_dir):
+    assert allowed(live_dir / "live" / "cam.ts")
+    assert allowed(live_dir / "live")
+
+def test_sibling_directory_sharing_the_prefix_is_refused(live_dir):
+    assert not allowed(live_dir / "live-private" / "cam.ts")
+    assert not allowed(str(live_dir / "live") + "-private")
+
+def test_traversal_out_of_the_prefix_is_refused(live_dir):
+    assert not allowed(os.path.join(live_dir, "live", "..", "outside", "cam.ts"))
+
+def test_symlink_escaping_the_prefix_is_refused(live_dir):
+    os.symlink(live_dir / "outside", live_dir / "live" / "escape")
+    os.symlink(live_dir / "outside" / "cam.ts", live_dir / "live" / "escape.ts")
+    assert not allowed(live_dir / "live" / "escape" / "cam.ts")
+    assert not allowed(live_dir / "live" / "escape.ts")
+
+def test_symlink_into_the_prefix_is_allowed(live_dir):
+    os.symlink(live_dir / "live" / "cam.ts", live_dir / "outside" / "in.ts")
+    assert allowed(live_dir / "outside" / "in.ts")
+
+def test_urls_must_match_scheme_and_host_exactly(live_dir):
+    assert allowed("rtsp://cam.local/streams/1")
+    assert allowed("RTSP://CAM.LOCAL/streams")
+    assert not allowed("rtsp://cam.local.evil/streams/1")
+    assert not allowed("rtsp://cam.local@evil/streams/1")
+    assert not allowed("rtsp://cam.local:8554/streams/1")
+    assert not allowed("http://cam.local/streams/1")
+
+def test_url_paths_match_on_whole_segments(live_dir):
+    assert not allowed("rtsp://cam.local/streams-private/1")
+    assert not allowed("rtsp://cam.local/other")
+
+def test_url_prefixes_do_not_allow_file_sources(live_dir, monkeypatch):
+    monkeypatch.setattr(main, "LIVE_SOURCES", ["rtsp://cam.local/streams", f"file://{live_dir / 'live'}"])
+    assert not allowed(live_dir / "live" / "cam.ts")
+    assert not allowed("/streams/1")
+
+def test_file_prefixes_do_not_allow_urls(live_dir):
+    assert not allowed(f"file://{live_dir / 'live' / 'cam.ts'}")
+    assert not allowed(f"http://example.com{live_dir / 'live' / 'cam.ts'}")
+
+def test_empty_allowlist_refuses_everything(live_dir, monkeypatch):
+    monkeypatch.setattr(main, "LIVE_SOURCES", [])
+    assert not allowed(live_dir / "live" / "cam.ts")
+    assert not allowed("rtsp://cam.local/streams/1")
+    assert not allowed("/")
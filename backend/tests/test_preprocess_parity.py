@@ -0,0 +1,48 @@
+"""FramePreprocessor against the original PIL/torchvision path on a small encoded clip.
+
+Run from backend/ with `python -m pytest tests`.
+"""
+import av
+import numpy as np
+import pytest
+
+from model import CONFIG, IMAGENET_STD, FramePreprocessor
+from parity import PREPROCESS_TOLERANCE, preprocess_parity, read_frames, reference_preprocess, synthetic_frames
+
+FRAMES = 8
+
+@pytest.fixture(scope="module")
+def clip(tmp_path_factory):
+    """An H.264 clip of moving gradients and noise at an odd size, decoded back to BGR frames."""
+    path = str(tmp_path_factory.mktemp("clip") / "clip.mp4")
+    with av.open(path, "w") as cont:
+        stream = cont.add_stream("libx264", rate=8)
+        stream.width, stream.height, stream.pix_fmt = 318, 242, "yuv420p"
+        for frame in synthetic_frames(FRAMES, 242, 318, seed=1):
+            for packet in stream.encode(av.VideoFrame.from_ndarray(frame, format="bgr24")):
+                cont.mux(packet)
+        for packet in stream.encode():
+            cont.mux(packet)
+    return read_frames(path, FRAMES)
+
+def boxes(frames, box):
+    return [box] * len(frames)
+
+@pytest.mark.parametrize("box", [None, (48, 220, 130, 100), (5, 41, 33, 9)],
+                         ids=["full frame", "face crop", "small crop"])
+def test_matches_reference_within_tolerance(clip, box):
+    assert len(clip) == FRAMES
+    stats = preprocess_parity(clip, boxes(clip, box))
+    assert stats["max_abs_diff"] <= PREPROCESS_TOLERANCE
+    # Rounding differences touch few pixels, so the mean stays far below one level
+    assert stats["mean_abs_diff"] < 0.5 / 255 / min(IMAGENET_STD)
+
+def test_tolerance_catches_real_bugs(clip):
+    """The bound leaves margin over rounding but not over an actual preprocessing mistake."""
+    box = (48, 220, 130, 100)
+    ref = reference_preprocess(clip, boxes(clip, box), CONFIG['frame_size'])
+    preprocess = FramePreprocessor(CONFIG['frame_size'], channel_order='bgr')
+    swapped = preprocess([np.ascontiguousarray(frame[..., ::-1]) for frame in clip], boxes(clip, box))
+    assert float((swapped - ref).abs().max()) > PREPROCESS_TOLERANCE
+    shifted = preprocess(clip, boxes(clip, (box[0] + 1, box[1] + 1, box[2] + 1, box[3] + 1)))
+    assert float((shifted - ref).abs().max()) > PREPROCESS_TOLERANCE
@@ -0,0 +1,134 @@
+"""WindowSchedule and the scan modes of sliding_window_inference, on a stub model.
+
+Each frame of the test clip is a flat colour that encodes its index, and
+the stub backbone recovers it, so the stub temporal model knows exactly
+which frames every window holds and gives each window start a preset
+probability.
+"""
+import json
+
+import av
+import numpy as np
+import pytest
+import torch
+
+from model import CONFIG, IMAGENET_MEAN, IMAGENET_STD, WindowSchedule, sliding_window_inference
+
+FRAMES = 96
+WSIZE, STRIDE, COARSE = 16, 8, 32
+
+def frame_colour(idx):
+    return 20 + 8 * (idx // 16), 20 + 8 * (idx % 16), 128
+
+class IndexModel:
+    """encode() recovers frame indices from pixel values; score() looks windows up by start."""
+    def __init__(self, probabilities, default=0.01):
+        self.probabilities = probabilities
+        self.default = default
+        self.encoded = []
+        self.bad_windows = []
+
+    def encode(self, x):
+        mean = torch.tensor(IMAGENET_MEAN).view(1, 3)
+        std = torch.tensor(IMAGENET_STD).view(1, 3)
+        levels = (x.mean(dim=(2, 3)) * std + mean) * 255
+        idx = (torch.round((levels[:, 0] - 20) / 8) * 16 + torch.round((levels[:, 1] - 20) / 8)).long()
+        self.encoded.extend(idx.tolist())
+        return idx.float().unsqueeze(1)
+
+    def score(self, emb):
+        logits = []
+        for window in emb[..., 0].long().tolist():
+            start = window[0]
+            if window != list(range(start, start + len(window))):
+                self.bad_windows.append(window)
+            p = self.probabilities.get(start, self.default)
+            logits.append(float(np.log(p / (1 - p))))
+        return torch.tensor(logits)
+
+@pytest.fixture(scope="module")
+def clip(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("scan") / "index.mp4")
+    with av.open(path, "w") as cont:
+        stream = cont.add_stream("libx264", rate=24, options={"qp": "0"})
+        stream.width, stream.height, stream.pix_fmt = 64, 64, "yuv420p"
+        for idx in range(FRAMES):
+            frame = np.empty((64, 64, 3), np.uint8)
+            frame[:] = frame_colour(idx)
+            for packet in stream.encode(av.VideoFrame.from_ndarray(frame, format="rgb24")):
+                cont.mux(packet)
+        for packet in stream.encode():
+            cont.mux(packet)
+    return path
+
+def analyze(model, clip, scan_mode):
+    cfg = {**CONFIG, "scan_mode": scan_mode, "window_size": WSIZE, "window_stride": STRIDE,
+           "coarse_stride": COARSE, "windows_per_batch": 1, "pipeline": False, "face_detect_workers": 0,
+           "timing_events": False}
+    for message in sliding_window_inference(model, clip, cfg):
+        if message.startswith("RESULT:"):
+            return json.loads(message[len("RESULT:"):])
+
+def schedule(scan_mode="coarse_to_fine"):
+    return WindowSchedule({**CONFIG, "scan_mode": scan_mode, "window_size": WSIZE, "window_stride": STRIDE,
+                           "coarse_stride": COARSE})
+
+def test_coarse_stride_rounds_down_to_a_multiple_of_the_stride():
+    assert schedule().coarse == COARSE
+    assert WindowSchedule({**CONFIG, "scan_mode": "coarse_to_fine", "window_size": WSIZE,
+                           "window_stride": STRIDE, "coarse_stride": 37}).coarse == 32
+    assert schedule("full").coarse == STRIDE
+
+def test_refinement_schedules_dense_starts_around_a_coarse_window():
+    s = schedule()
+    assert s.ready(WSIZE - 1) == [0]
+    assert s.record(0, 0.01) == []
+    assert s.ready(COARSE + WSIZE - 1) == [COARSE]
+    assert s.record(COARSE, 0.03) == [8, 16, 24, 40, 48, 56]
+    # Refinements behind the current frame are ready at once, later ones as their frames arrive
+    assert s.ready(COARSE + WSIZE - 1) == [8, 16, 24]
+    # Handed-out starts come back until they are recorded
+    assert s.ready(COARSE + WSIZE - 1) == [8, 16, 24]
+    for start in (8, 16, 24):
+        assert s.record(start, 0.01) == []
+    assert s.ready(40 + WSIZE - 1) == [40]
+    s.record(40, 0.01)
+    assert s.ready(48 + WSIZE - 1) == [48]
+    assert not s.needs(80) and s.needs(63) and s.needs(20)
+
+def test_full_scan_scores_every_window_from_consecutive_frames(clip):
+    model = IndexModel({})
+    result = analyze(model, clip, "full")
+    assert result["window_starts"] == list(range(0, FRAMES - WSIZE + 1, STRIDE))
+    assert model.bad_windows == []
+    assert sorted(model.encoded) == list(range(FRAMES))
+
+def test_early_exit_stops_at_the_first_window_above_threshold(clip):
+    model = IndexModel({24: 0.9, 48: 0.95})
+    result = analyze(model, clip, "early_exit")
+    assert result["early_exit"] is True
+    assert result["window_starts"] == [0, 8, 16, 24]
+    assert result["probabilities"][-1] == pytest.approx(0.9)
+    assert result["is_deepfake"] is True
+
+def test_coarse_to_fine_matches_the_full_scan_at_its_starts(clip):
+    probabilities = {COARSE: 0.03}
+    full = analyze(IndexModel(probabilities), clip, "full")
+    model = IndexModel(probabilities)
+    result = analyze(model, clip, "coarse_to_fine")
+    assert model.bad_windows == []
+    assert result["window_starts"] == [0, 8, 16, 24, 32, 40, 48, 56, 64]
+    by_start = dict(zip(full["window_starts"], full["probabilities"]))
+    assert result["probabilities"] == pytest.approx([by_start[s] for s in result["window_starts"]])
+    assert result["is_deepfake"] == full["is_deepfake"]
+
+def test_frames_refined_late_are_encoded_from_pending(clip):
+    model = IndexModel({COARSE: 0.03})
+    analyze(model, clip, "coarse_to_fine")
+    # Each needed frame is encoded once; the last coarse-only gap is never encoded
+    assert sorted(model.encoded) == list(range(80))
+    # Frames 16-31 belong to no coarse window: they wait in `pending` and are
+    # encoded only after window 32 asks for refinement
+    first_late = model.encoded.index(16)
+    assert model.encoded[first_late:first_late + 16] == list(range(16, 32))
+    assert model.encoded.index(COARSE + WSIZE - 1) < first_late
@@ -0,0 +1,25 @@
+"""Per-frame encode/score against the model's own forward pass on stacked windows."""
+import pytest
+import torch
+
+from model import CONFIG, VisualOnlyM3TNet
+
+WINDOWS, WSIZE, STRIDE = 3, 4, 2
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    return VisualOnlyM3TNet(CONFIG, pretrained=False).eval()
+
+def test_windows_from_shared_frame_embeddings_match_forward(model):
+    size = CONFIG['frame_size']
+    frames = torch.randn((WINDOWS - 1) * STRIDE + WSIZE, 3, size, size, generator=torch.Generator().manual_seed(1))
+    starts = [k * STRIDE for k in range(WINDOWS)]
+    with torch.no_grad():
+        # The old path: every window's frames through the whole model
+        reference = model(torch.stack([frames[s:s + WSIZE] for s in starts]))
+        # The new path: each frame encoded once, overlapping windows assembled from its embedding
+        emb = model.encode(frames)
+        logits = model.score(torch.stack([emb[s:s + WSIZE] for s in starts]))
+    assert logits.shape == reference.shape
+    assert torch.allclose(torch.sigmoid(logits), torch.sigmoid(reference), atol=1e-5)
@@ -0,0 +1,213 @@
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from multiprocessing.connection import Connection
+from multiprocessing.reduction import recv_handle, send_handle
+
+import torch
+
+from model import sliding_window_inference
+
+def worker_cpus(index, threads, cpus=None):
+    """The CPUs worker `index` is pinned to: its own block of `threads` CPUs, wrapping around."""
+    cpus = sorted(cpus if cpus is not None else os.sched_getaffinity(0))
+    start = (index * threads) % len(cpus)
+    return {cpus[(start + k) % len(cpus)] for k in range(min(threads, len(cpus)))}
+
+def _serve(conn, model, threads, cpus, thumbnails):
+    """Worker loop: run one analysis at a time, streaming its messages back to the parent."""
+    torch.set_num_threads(threads)
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        if task == ("cancel",):
+            continue  # the analysis it was meant for had already finished
+        _, path, cfg, filename = task
+        error = None
+        gen = sliding_window_inference(model, path, cfg, filename, thumbnails)
+        try:
+            for message in gen:
+                conn.send(("msg", message))
+                if conn.poll() and conn.recv() == ("cancel",):
+                    break
+        except Exception as e:
+            error = str(e)
+        finally:
+            gen.close()
+        conn.send(("done", error))
+
+def _zygote(control, model, threads, thumbnails):
+    """Forks inference workers on request from the parent.
+
+    It is forked while the parent is still quiescent and never starts a
+    thread itself, so forking from it stays safe however many threads the
+    parent runs later. Each request is (index, cpus) followed by the
+    worker's end of a pipe; the reply is the worker's pid.
+    """
+    # Exited workers are reaped by the kernel, so their pids disappear
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        try:
+            request = control.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        _, cpus = request
+        fd = recv_handle(control)
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            control.close()
+            status = 0
+            try:
+                _serve(Connection(fd), model, threads, cpus, thumbnails)
+            except BaseException:
+                status = 1
+            finally:
+                os._exit(status)
+        os.close(fd)
+        control.send(pid)
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class _Worker:
+    def __init__(self, index, pid, conn):
+        self.index = index
+        self.pid = pid
+        self.conn = conn
+
+    def is_alive(self):
+        return _alive(self.pid)
+
+class WorkerPool:
+    """Inference processes forked from a parent that holds the loaded model.
+
+    Forked workers see the parent's weights copy-on-write (and a
+    memory-mapped checkpoint through the shared page cache), so N workers
+    cost one copy of the model. Each worker sets its own torch thread count
+    and, with `pin_cpus`, is pinned to its own block of CPUs so workers do
+    not oversubscribe cores. The parent must not have run torch's parallel
+    kernels before forking: keep it at torch.set_num_threads(1).
+
+    The parent forks only once, when the pool is created: a single-threaded
+    zygote process that then forks every worker, including replacements
+    for workers that die while the parent is busy with other threads.
+
+    `analyze` has the sliding_window_inference signature and yields the
+    worker's messages, so it plugs into JobManager; one analysis runs per
+    worker at a time.
+    """
+    def __init__(self, model, workers=2, threads=None, pin_cpus=False, thumbnails=None):
+        self.model = model
+        self.workers = workers
+        self.threads = threads or max(1, len(os.sched_getaffinity(0)) // workers)
+        self.pin_cpus = pin_cpus
+        self.thumbnails = thumbnails
+        self.restarts = 0
+        context = multiprocessing.get_context("fork")
+        self._control, child = context.Pipe()
+        self._zygote = context.Process(target=_zygote, name="inference-zygote", daemon=True,
+                                       args=(child, model, self.threads, thumbnails))
+        self._zygote.start()
+        child.close()
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._all = [self._start(i) for i in range(workers)]
+        for worker in self._all:
+            self._idle.put(worker)
+
+    def _start(self, index):
+        """Have the zygote fork worker `index`."""
+        cpus = worker_cpus(index, self.threads) if self.pin_cpus else None
+        parent, child = multiprocessing.Pipe()
+        try:
+            self._control.send((index, cpus))
+            send_handle(self._control, child.fileno(), self._zygote.pid)
+            pid = self._control.recv()
+        finally:
+            child.close()
+        return _Worker(index, pid, parent)
+
+    def _restart(self, worker):
+        worker.conn.close()
+        with self._lock:
+            self.restarts += 1
+            replacement = self._start(worker.index)
+            self._all[worker.index] = replacement
+        return replacement
+
+    def analyze(self, path, cfg, filename=None):
+        """Run an analysis on the next idle worker, yielding its messages."""
+        worker = self._idle.get()
+        if not worker.is_alive():
+            worker = self._restart(worker)
+        done = False
+        try:
+            worker.conn.send(("run", path, cfg, filename))
+            while True:
+                kind, payload = worker.conn.recv()
+                if kind == "msg":
+                    yield payload
+                    continue
+                done = True
+                if payload is not None:
+                    raise RuntimeError(payload)
+                return
+        except (EOFError, OSError):
+            done = True
+            worker = self._restart(worker)
+            raise RuntimeError("Inference worker exited during the analysis")
+        finally:
+            if not done:
+                # Closed early (cancelled): stop the worker and discard what it already sent
+                try:
+                    worker.conn.send(("cancel",))
+                    while worker.conn.recv()[0] != "done":
+                        pass
+                except (EOFError, OSError):
+                    worker = self._restart(worker)
+            self._idle.put(worker)
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.workers, "threads_per_worker": self.threads, "pin_cpus": self.pin_cpus,
+                    "idle": self._idle.qsize(), "restarts": self.restarts,
+                    "pids": [w.pid for w in self._all],
+                    "alive": sum(w.is_alive() for w in self._all)}
+
+    def shutdown(self):
+        for worker in self._all:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        deadline = time.monotonic() + 5
+        for worker in self._all:
+            while worker.is_alive() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+        try:
+            self._control.send(None)
+        except OSError:
+            pass
+        self._zygote.join(timeout=5)
+        if self._zygote.is_alive():
+            self._zygote.terminate()
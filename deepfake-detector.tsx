@@ -15,9 +15,11 @@ interface AnalysisResult {
   filename?: string;
   probabilities?: number[];
   face_images_b64?: string[];
+  face_image_ids?: string[];
   total_frames?: number;
   video_duration_seconds?: number;
   windows_analyzed?: number;
+  jobId?: string;
   error?: string;
 }
 
@@ -89,6 +91,8 @@ export default function Component() {
 
     const formData = new FormData()
     formData.append("file", file)
+    // Face thumbnails by ID keep the final result line small
+    formData.append("result_format", "compact")
 
     try {
       const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/analyze/`, {
@@ -99,16 +103,20 @@ export default function Component() {
       if (!response.body) {
         throw new Error("Response body is null")
       }
+      const jobId = response.headers.get("X-Job-Id") ?? undefined
 
       const reader = response.body.getReader()
       const decoder = new TextDecoder()
       let done = false
+      // A read can end mid-message; keep the partial message for the next one
+      let buffered = ""
 
       while (!done) {
         const { value, done: readerDone } = await reader.read()
         done = readerDone
-        const chunk = decoder.decode(value, { stream: true })
-        const lines = chunk.split("\n\n").filter(Boolean)
+        buffered += decoder.decode(value, { stream: true })
+        const lines = buffered.split("\n\n")
+        buffered = lines.pop() ?? ""
 
         lines.forEach((line) => {
           if (line.startsWith("data: ")) {
@@ -126,9 +134,11 @@ export default function Component() {
                 filename: backendResult.filename,
                 probabilities: backendResult.probabilities,
                 face_images_b64: backendResult.face_images_b64,
+                face_image_ids: backendResult.face_image_ids,
                 total_frames: backendResult.total_frames,
                 video_duration_seconds: backendResult.video_duration_seconds,
                 windows_analyzed: backendResult.windows_analyzed,
+                jobId,
               })
               setScanProgress(100)
               setAnalysisLogs((prevLogs) => [...prevLogs, "Analysis complete. Finalizing report..."])
@@ -179,18 +189,25 @@ export default function Component() {
         confidence: result.confidence,
         probabilities: result.probabilities,
         face_images_b64: result.face_images_b64,
+        face_image_ids: result.face_image_ids,
         total_frames: result.total_frames,
         video_duration_seconds: result.video_duration_seconds,
         windows_analyzed: result.windows_analyzed,
       };
 
-      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/generate-report/`, {
-        method: "POST",
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify(reportPayload),
-      });
+      // The server keeps finished jobs for a while; only re-send the result once it is gone
+      let response = result.jobId
+        ? await fetch(`${process.env.NEXT_PUBLIC_API_URL}/jobs/${result.jobId}/report`)
+        : null;
+      if (!response || response.status === 404) {
+        response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/generate-report/`, {
+          method: "POST",
+          headers: {
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify(reportPayload),
+        });
+      }
 
       if (!response.ok) {
         throw new Error("Report generation failed");